@@ -0,0 +1,155 @@
+import math
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from config import (
+    MAX_CONCURRENT_REQUESTS, REQUEST_QUEUE_SIZE, REQUEST_QUEUE_TIMEOUT,
+    EMBEDDING_CONCURRENCY, RETRIEVAL_CONCURRENCY, LLM_CONCURRENCY
+)
+
+
+class Overloaded(Exception):
+    """Raised when a request is turned away instead of queued without bound."""
+
+    def __init__(self, message, status_code=429, retry_after=1):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class StageLimiter:
+    """Caps concurrent calls into one downstream stage (embedding, retrieval, LLM); a limit of 0 disables it."""
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self._semaphore = asyncio.Semaphore(limit) if limit > 0 else None
+        self.active = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.calls = 0
+        self._wait_total = 0.0
+
+    @asynccontextmanager
+    async def slot(self):
+        self.calls += 1
+        if self._semaphore is None:
+            self.active += 1
+            try:
+                yield
+            finally:
+                self.active -= 1
+            return
+
+        started = time.perf_counter()
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self._wait_total += time.perf_counter() - started
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "calls": self.calls,
+            "avg_wait_ms": round(1000 * self._wait_total / self.calls, 3) if self.calls else 0.0,
+        }
+
+
+class AdmissionController:
+    """
+    Front door for the expensive endpoints. Up to `max_concurrent` requests run
+    at once and up to `max_queue` more wait for a slot. A request that finds the
+    queue full is rejected with 429; one that waits longer than `queue_timeout`
+    seconds is rejected with 503. Retry-After is estimated from the recent
+    average service time and the queue ahead of the caller.
+    """
+
+    # Weight of the newest sample in the service time moving average
+    _EWMA_WEIGHT = 0.2
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_REQUESTS, max_queue=REQUEST_QUEUE_SIZE,
+                 queue_timeout=REQUEST_QUEUE_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent) if max_concurrent > 0 else None
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self._service_time = 1.0
+
+    @property
+    def enabled(self):
+        return self._semaphore is not None
+
+    def retry_after(self):
+        backlog = self.waiting + 1
+        return max(1, math.ceil(backlog * self._service_time / max(self.max_concurrent, 1)))
+
+    @asynccontextmanager
+    async def admit(self):
+        if self._semaphore is None:
+            yield
+            return
+
+        if not self._semaphore.locked():
+            # A free slot is taken without suspending, so the queue check below sees it
+            await self._semaphore.acquire()
+        elif self.waiting >= self.max_queue:
+            self.rejected_full += 1
+            raise Overloaded("Server is at capacity, try again shortly", 429, self.retry_after())
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected_timeout += 1
+                raise Overloaded("Timed out waiting for capacity, try again shortly", 503, self.retry_after())
+            finally:
+                self.waiting -= 1
+
+        self.admitted += 1
+        self.active += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self._service_time += self._EWMA_WEIGHT * (elapsed - self._service_time)
+            self.active -= 1
+            self._semaphore.release()
+
+    def stats(self):
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected_full": self.rejected_full,
+            "rejected_timeout": self.rejected_timeout,
+            "avg_service_ms": round(1000 * self._service_time),
+            "stages": {name: stage.stats() for name, stage in stages.items()},
+        }
+
+
+stages = {
+    "embedding": StageLimiter("embedding", EMBEDDING_CONCURRENCY),
+    "retrieval": StageLimiter("retrieval", RETRIEVAL_CONCURRENCY),
+    "llm": StageLimiter("llm", LLM_CONCURRENCY),
+}
+admission = AdmissionController()
@@ -5,11 +5,12 @@ import aiohttp
 import asyncio
 import sys
 import os
+import time
+import resource
 from datetime import datetime
 from typing import Annotated, Literal
 from enum import Enum
-from pinecone import Pinecone
-from sentence_transformers import SentenceTransformer
+import numpy as np
 from pydantic import BaseModel
 
 from dotenv import load_dotenv
@@ -32,22 +33,144 @@ from livekit.plugins import openai, deepgram, elevenlabs, silero
 
 
 load_dotenv(dotenv_path=".env.local")
+# Imported after .env.local is loaded so config.py sees those variables
+from vector_store import open_vector_store
+from embeddings import load_embedding_model, encode_async
+from answer_cache import normalize_query
+from chunk_store import lookup_texts
+from context_packing import pack_contexts
+from telemetry import span, collect_timings, format_timings
+from config import AGENT_SHARED_MODEL, AGENT_TORCH_THREADS, PINECONE_DIMENSION
 logger = logging.getLogger("voice-agent")
 logger.setLevel(logging.INFO)
 
-# Initialize these ONCE at module level to avoid reloading
-try:
-    embedding_model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-    pinecone_api_key = os.getenv("PINECONE_API_KEY")
-    if not pinecone_api_key:
-        raise ValueError("PINECONE_API_KEY environment variable is required")
-    pc = Pinecone(api_key=pinecone_api_key)
-    index = pc.Index("document-collection")
-except Exception as e:
-    logger.warning(f"Could not initialize Pinecone/SentenceTransformers: {e}")
-    embedding_model = None
-    pc = None
-    index = None
+# With AGENT_SHARED_MODEL the model is loaded when this module is imported by the
+# worker's forkserver (see __main__), so every forked job process shares its weights
+# copy-on-write instead of loading a private copy in prewarm.
+shared_embedding_model = None
+if AGENT_SHARED_MODEL:
+    try:
+        shared_embedding_model = load_embedding_model()
+    except Exception as e:
+        logger.warning(f"Could not preload shared embedding model: {e}")
+
+
+class KnowledgePrefetcher:
+    """
+    Speculatively runs knowledge-base retrieval from interim transcripts.
+
+    While the user is still speaking, each sufficiently grown transcript
+    starts an embed + vector query in the background. When the LLM later
+    calls search_knowledge_base, a prefetched result is reused if its
+    transcript matches the tool question exactly or its embedding is at least
+    `similarity` cosine-similar, so the tool call often skips retrieval.
+    """
+
+    def __init__(self, index, top_k=3, min_chars=12, min_growth=8, similarity=0.8):
+        self.index = index
+        self.top_k = top_k
+        self.min_chars = min_chars
+        self.min_growth = min_growth
+        self.similarity = similarity
+        self._text = ""
+        self._task = None
+        self.hits = 0
+        self.misses = 0
+
+    def on_transcript(self, transcript, is_final):
+        text = normalize_query(transcript)
+        if len(text) < self.min_chars or text == self._text:
+            return
+        if not is_final and len(text) - len(self._text) < self.min_growth:
+            return
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._text = text
+        self._task = asyncio.create_task(self._retrieve(text))
+
+    async def _retrieve(self, text):
+        started = time.perf_counter()
+        embedding = await encode_async(text)
+        results = await self.index.aquery(vector=embedding, top_k=self.top_k, include_metadata=True)
+        logger.info(f"Prefetched knowledge for '{text[:40]}' in {1000 * (time.perf_counter() - started):.0f}ms")
+        return text, embedding, results
+
+    async def search(self, question):
+        """Return (results, prefetch_hit) for the tool question, reusing a prefetch when it matches."""
+        normalized = normalize_query(question)
+        prefetched = None
+        task = self._task
+        if task is not None:
+            try:
+                with span("prefetch_wait"):
+                    prefetched = await task
+            except asyncio.CancelledError:
+                # Only swallow the prefetch's own cancellation, not ours
+                if not task.cancelled():
+                    raise
+            except Exception as e:
+                logger.warning(f"Knowledge prefetch failed: {e}")
+
+        if prefetched is not None and prefetched[0] == normalized:
+            self.hits += 1
+            return prefetched[2], True
+
+        with span("embed"):
+            embedding = await encode_async(question)
+        if prefetched is not None:
+            a = np.asarray(embedding)
+            b = np.asarray(prefetched[1])
+            if float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-12)) >= self.similarity:
+                self.hits += 1
+                return prefetched[2], True
+
+        self.misses += 1
+        with span("retrieve"):
+            results = await self.index.aquery(vector=embedding, top_k=self.top_k, include_metadata=True)
+        return results, False
+
+
+class TurnLatencyTracker:
+    """
+    Combines per-turn pipeline metrics into voice turn latency:
+    end-of-utterance delay + LLM time-to-first-token + TTS time-to-first-byte.
+    """
+
+    def __init__(self):
+        self._turns = {}
+        self.latencies = []
+
+    def collect(self, m):
+        speech_id = getattr(m, "speech_id", None)
+        if speech_id is None:
+            return
+        parts = self._turns.setdefault(speech_id, {})
+        if isinstance(m, metrics.EOUMetrics):
+            parts["eou"] = m.end_of_utterance_delay
+        elif isinstance(m, metrics.LLMMetrics):
+            parts.setdefault("llm_ttft", m.ttft)
+        elif isinstance(m, metrics.TTSMetrics):
+            parts.setdefault("tts_ttfb", m.ttfb)
+        if {"eou", "llm_ttft", "tts_ttfb"} <= parts.keys():
+            total = parts["eou"] + parts["llm_ttft"] + parts["tts_ttfb"]
+            self.latencies.append(total)
+            del self._turns[speech_id]
+            logger.info(
+                f"⏱️ Voice turn latency {1000 * total:.0f}ms "
+                f"(eou={1000 * parts['eou']:.0f}ms, llm_ttft={1000 * parts['llm_ttft']:.0f}ms, "
+                f"tts_ttfb={1000 * parts['tts_ttfb']:.0f}ms)"
+            )
+
+    def summary(self):
+        if not self.latencies:
+            return {"turns": 0}
+        ordered = sorted(self.latencies)
+        return {
+            "turns": len(ordered),
+            "avg_ms": round(1000 * sum(ordered) / len(ordered)),
+            "p50_ms": round(1000 * ordered[len(ordered) // 2]),
+            "max_ms": round(1000 * ordered[-1]),
+        }
 
 
 class MyAgent(Agent):
@@ -85,12 +208,66 @@ async def get_time():
     return datetime.now().strftime("%H:%M:%S")
 
 
+def _rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
 def prewarm(proc: JobProcess):
+    """
+    Load everything a job needs before the process accepts calls: VAD, the
+    embedding model (plus one warm-up encode) and the vector store (plus one
+    warm-up query). Results are shared with jobs through proc.userdata.
+    """
+    timings = {}
+    started = time.perf_counter()
+
+    if AGENT_TORCH_THREADS > 0:
+        import torch
+        torch.set_num_threads(AGENT_TORCH_THREADS)
+
+    step = time.perf_counter()
     proc.userdata["vad"] = silero.VAD.load()
+    timings["vad_ms"] = round(1000 * (time.perf_counter() - step))
+
+    proc.userdata["embedding_model"] = None
+    proc.userdata["index"] = None
+    try:
+        step = time.perf_counter()
+        embedding_model = shared_embedding_model or load_embedding_model()
+        timings["embedding_model_ms"] = round(1000 * (time.perf_counter() - step))
+
+        step = time.perf_counter()
+        embedding_model.encode(["warm up"])
+        timings["warmup_encode_ms"] = round(1000 * (time.perf_counter() - step))
+
+        step = time.perf_counter()
+        index = open_vector_store()
+        # Scoped to one namespace: an unscoped query would be one round trip per book
+        index.query(
+            vector=[0.0] * (PINECONE_DIMENSION - 1) + [1.0], top_k=1, include_metadata=False,
+            namespace=next(iter(index.namespaces()), "")
+        )
+        timings["vector_store_ms"] = round(1000 * (time.perf_counter() - step))
+
+        proc.userdata["embedding_model"] = embedding_model
+        proc.userdata["index"] = index
+    except Exception as e:
+        logger.warning(f"Could not initialize vector store/embedding model: {e}")
+
+    timings["total_ms"] = round(1000 * (time.perf_counter() - started))
+    logger.info(
+        f"Prewarmed job process {os.getpid()} (shared model: {shared_embedding_model is not None}, "
+        f"rss {_rss_mb():.0f}MB): {timings}"
+    )
 
 
 async def entrypoint(ctx: JobContext):
     
+    embedding_model = ctx.proc.userdata.get("embedding_model")
+    index = ctx.proc.userdata.get("index")
+    prefetcher = KnowledgePrefetcher(index)
+    
     @function_tool
     async def search_knowledge_base(question: str) -> str:
         """
@@ -105,34 +282,30 @@ async def entrypoint(ctx: JobContext):
             if not embedding_model or not index:
                 return "Knowledge base is not available. Please ask general questions and I'll try to help."
 
-            # Use the actual question for embedding
-            query_embedding = embedding_model.encode(question).tolist()
-
-            # Query Pinecone
-            query_params = {
-                "vector": query_embedding,
-                "top_k": 3,
-                "include_metadata": True
-            }
-            results = index.query(**query_params)
+            with collect_timings() as timings:
+                # Embedding runs on the embedding pool and the query is async, so the event loop
+                # (audio, VAD) is never blocked; a matching prefetch skips both
+                started = time.perf_counter()
+                results, prefetch_hit = await prefetcher.search(question)
 
-            logger.info(f"Found {len(results.matches)} results")
+                logger.info(
+                    f"Found {len(results.matches)} results in {1000 * (time.perf_counter() - started):.0f}ms "
+                    f"(prefetch {'hit' if prefetch_hit else 'miss'})"
+                )
 
-            # Extract context from results
-            if not results.matches:
-                return "I couldn't find any relevant information in the knowledge base for this question. Could you rephrase or ask something else?"
+                # Extract context from results
+                if not results.matches:
+                    return "I couldn't find any relevant information in the knowledge base for this question. Could you rephrase or ask something else?"
 
-            contexts = [
-                match.metadata['text']
-                for match in results.matches
-                if 'text' in match.metadata
-            ]
+                # Adjacent chunks are stitched and near-duplicates dropped before they reach the LLM
+                with span("context_pack"):
+                    context, _ = pack_contexts(results.matches, lookup_texts(results.matches))
 
-            if not contexts:
-                return "I found some results but they don't contain text information. Please contact support."
+                if not context:
+                    return "I found some results but they don't contain text information. Please contact support."
 
+            logger.info(f"Knowledge search stages: {format_timings(timings)}")
             # Return clear, structured response
-            context = "\n\n".join(contexts)
             return f"Based on the knowledge base, here's what I found:\n\n{context}"
 
         except Exception as e:
@@ -190,10 +363,24 @@ Do NOT call functions repeatedly. One call per question.""",
     )
 
     usage_collector = metrics.UsageCollector()
+    turn_latency = TurnLatencyTracker()
+
+    @session.on("metrics_collected")
+    def _on_metrics_collected(ev):
+        metrics.log_metrics(ev.metrics)
+        usage_collector.collect(ev.metrics)
+        turn_latency.collect(ev.metrics)
+
+    @session.on("user_input_transcribed")
+    def _on_user_input_transcribed(ev):
+        if index is not None and embedding_model is not None:
+            prefetcher.on_transcript(ev.transcript, ev.is_final)
 
     async def log_usage():
         summary = usage_collector.get_summary()
         logger.info(f"Summary Usage: {summary}")
+        logger.info(f"Voice turn latency: {turn_latency.summary()}")
+        logger.info(f"Knowledge prefetch: {prefetcher.hits} hits, {prefetcher.misses} misses")
 
     # At shutdown, generate and log the summary from the usage collector
     ctx.add_shutdown_callback(log_usage)
@@ -203,6 +390,10 @@ Do NOT call functions repeatedly. One call per question.""",
 
 
 if __name__ == "__main__":
+    if AGENT_SHARED_MODEL:
+        import multiprocessing
+        # Job processes are forked from the forkserver; importing this module there loads the shared model once
+        multiprocessing.set_forkserver_preload(["agent"])
     cli.run_app(
         WorkerOptions(
             entrypoint_fnc=entrypoint,
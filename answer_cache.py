@@ -0,0 +1,117 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from config import ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_SEMANTIC_THRESHOLD
+
+
+def normalize_query(query):
+    """Case-fold, collapse whitespace and drop trailing punctuation so trivially different phrasings share a key."""
+    return re.sub(r"\s+", " ", query).strip().lower().rstrip("?!. ")
+
+
+class AnswerCache:
+    """
+    Two-level cache of /query answers.
+
+    The exact tier is an LRU keyed on (normalized query, book, n_results,
+    index version). The semantic tier compares a new query's embedding with
+    the cached queries in the same (book, n_results, version) scope and
+    reuses an answer whose cosine similarity reaches `semantic_threshold`.
+    Both tiers share one size limit and TTL; a threshold above 1 disables the
+    semantic tier.
+    """
+
+    def __init__(self, max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, semantic_threshold=ANSWER_CACHE_SEMANTIC_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.semantic_threshold = semantic_threshold
+        self._lock = threading.Lock()
+        # key -> (expires_at, value, unit embedding)
+        self._entries = OrderedDict()
+        # scope -> (keys, stacked embeddings); rebuilt lazily after inserts/evictions
+        self._scopes = {}
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _evict_locked(self, key):
+        self._entries.pop(key, None)
+        self._scopes.pop(key[1:], None)
+
+    def get_exact(self, query, book, n_results, version):
+        key = (normalize_query(query), book, n_results, version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._evict_locked(key)
+                return None
+            self._entries.move_to_end(key)
+            self.hits_exact += 1
+            return entry[1]
+
+    def _scope_matrix_locked(self, scope):
+        cached = self._scopes.get(scope)
+        if cached is None:
+            keys = [key for key in self._entries if key[1:] == scope]
+            matrix = np.stack([self._entries[key][2] for key in keys]) if keys else None
+            cached = self._scopes[scope] = (keys, matrix)
+        return cached
+
+    def get_semantic(self, embedding, book, n_results, version):
+        if self.semantic_threshold > 1:
+            self.misses += 1
+            return None
+        scope = (book, n_results, version)
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        with self._lock:
+            keys, matrix = self._scope_matrix_locked(scope)
+            if matrix is not None:
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                key = keys[best]
+                entry = self._entries[key]
+                if scores[best] >= self.semantic_threshold:
+                    if entry[0] >= time.monotonic():
+                        self._entries.move_to_end(key)
+                        self.hits_semantic += 1
+                        return entry[1]
+                    self._evict_locked(key)
+            self.misses += 1
+            return None
+
+    def put(self, query, embedding, book, n_results, version, value):
+        key = (normalize_query(query), book, n_results, version)
+        unit = np.asarray(embedding, dtype=np.float32)
+        unit /= max(float(np.linalg.norm(unit)), 1e-12)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value, unit)
+            self._entries.move_to_end(key)
+            self._scopes.pop(key[1:], None)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._evict_locked(oldest)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "hits_exact": self.hits_exact,
+            "hits_semantic": self.hits_semantic,
+            "misses": self.misses,
+        }
+
+
+answer_cache = AnswerCache()
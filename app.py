@@ -1,34 +1,69 @@
 
 import os
+import json
 import asyncio
 import time
 import logging
-from contextlib import asynccontextmanager
-from typing import Optional
+from contextlib import asynccontextmanager, aclosing, AsyncExitStack
+from typing import Optional, Union
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 import uvicorn
 
-from query import query_collection, get_available_books, quizz_collection
+from query import (
+    query_collection, stream_query_collection, get_available_books, quizz_collection,
+    get_existing_collection, readiness, start_ingestion, warm_llm_client, close_clients, quiz_bank, quiz_filler, book_list
+)
+import embeddings
+from answer_cache import answer_cache, normalize_query
+from catalog import book_catalog
+from chunk_store import get_chunk_store
+from readiness import IndexNotReady
+from coalesce import SingleFlight, request_key
+from admission import admission, Overloaded
+import telemetry
+from config import AUTO_INGEST, REQUEST_DEADLINE, SERVER_TIMING
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class PDFRequest(BaseModel):
     query: str
-    book: Optional[str] = None
+    # One book, or a list of books searched together
+    book: Optional[Union[str, list[str]]] = None
     message: list[dict] = []
     n_results: Optional[int] = 3
+    conversation_id: Optional[str] = None
 class QuizzRequest(BaseModel):
-    book: Optional[str] = None
+    book: Optional[Union[str, list[str]]] = None
     n_results: Optional[int] = 3
     question: Optional[str] = 10
 
+# Concurrent identical /query and /quizz requests share one computation
+query_flights = SingleFlight("query")
+quizz_flights = SingleFlight("quizz")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("🚀 Starting wemakedev API...")
+    loop = asyncio.get_event_loop()
+    ready = await loop.run_in_executor(None, readiness.check, True)
+    if ready:
+        logger.info(f"✅ Index ready with {readiness.vector_count} vectors")
+    elif AUTO_INGEST:
+        logger.info(f"📥 Index not ready ({readiness.error or 'empty'}), starting background ingestion")
+        start_ingestion()
+    else:
+        logger.warning(f"⚠️ Index not ready: {readiness.error or 'empty'}")
+    await warm_llm_client()
+    quiz_filler.start()
     yield
     logger.info("🛑 Shutting down API...")
+    await quiz_filler.stop()
+    await close_clients()
+    embeddings.shutdown()
 
 app = FastAPI(
     title="WeMakeDev RAG API",
@@ -37,6 +72,32 @@ app = FastAPI(
 )
 
 
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    # Stage spans recorded while handling the request land in `timings`
+    started = time.perf_counter()
+    with telemetry.collect_timings() as timings:
+        response = await call_next(request)
+    route = request.scope.get("route")
+    endpoint = route.path if route else "unmatched"
+    if SERVER_TIMING:
+        # Headers go out before the body, so for /query/stream this covers time to the first byte only
+        response.headers["Server-Timing"] = telemetry.server_timing(timings, time.perf_counter() - started)
+
+    # The request histogram gets the full duration, including streamed bodies
+    body = response.body_iterator
+
+    async def observed_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            telemetry.observe_request(endpoint, request.method, response.status_code, time.perf_counter() - started)
+
+    response.body_iterator = observed_body()
+    return response
+
+
 @app.get('/')
 async def index():
     return {'message': 'WeMakeDev RAG API', 'version': '1.0.0'}
@@ -45,49 +106,176 @@ async def index():
 async def health_check():
     return {'status': 'healthy'}
 
+@app.get('/stats')
+async def stats():
+    return {
+        "embedding": embeddings.batcher.stats(),
+        "answer_cache": answer_cache.stats(),
+        "quiz_bank": quiz_bank.stats(),
+        "chunk_store": get_chunk_store().stats(),
+        "coalescing": {"query": query_flights.stats(), "quizz": quizz_flights.stats()},
+        "admission": admission.stats()
+    }
+
+@app.get('/metrics')
+async def metrics():
+    payload = telemetry.metrics_payload()
+    if payload is None:
+        raise HTTPException(status_code=404, detail="Metrics are disabled or prometheus_client is not installed")
+    body, content_type = payload
+    return Response(content=body, media_type=content_type)
+
+def not_ready_error(e: IndexNotReady):
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def overloaded_error(e: Overloaded):
+    return HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def deadline_error():
+    return HTTPException(status_code=504, detail=f"Request did not finish within {REQUEST_DEADLINE:g}s")
+
+async def run_request(flights, key, run):
+    """
+    Coalesce with identical in-flight requests, then pass admission control.
+    Only the request that actually computes takes an admission slot. Each
+    caller waits at most REQUEST_DEADLINE seconds; when the last caller
+    gives up, the shared computation is cancelled.
+    """
+    async def admitted():
+        async with admission.admit():
+            return await run()
+
+    return await asyncio.wait_for(flights.do(key, admitted), REQUEST_DEADLINE or None)
+
+@app.get('/ready')
+async def ready_check():
+    status = readiness.status()
+    if not status["ready"]:
+        raise HTTPException(status_code=503, detail=status)
+    return status
+
+@app.post('/ingest', status_code=202)
+async def start_ingest():
+    if not start_ingestion():
+        raise HTTPException(status_code=409, detail="Ingestion is already running")
+    return readiness.job.status()
+
+@app.get('/ingest/status')
+async def ingest_status():
+    return readiness.job.status()
+
 @app.get('/books')
 async def get_books():
     try:
-        loop = asyncio.get_event_loop()
-        books = await loop.run_in_executor(None, get_available_books)
-        return {"books": books, "count": len(books)}
+        books = await get_available_books()
+        return {"books": books, "count": len(books), "catalog": book_catalog.entries()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@app.post('/books/refresh')
+async def refresh_books():
+    book_catalog.invalidate()
+    book_catalog.refresh(force=True)
+    books = book_catalog.books()
+    return {"books": books, "count": len(books), "version": book_catalog.version}
 @app.post('/quizz')
 async def quizz_documents(request: QuizzRequest):
     try:
         logger.info(f"Processing quizz: ...")
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            None,
-            quizz_collection,
-            request.book,
-            request.n_results,
-            request.question
+        key = request_key(book_list(request.book), request.n_results, str(request.question))
+        result = await run_request(
+            quizz_flights, key, lambda: quizz_collection(request.book, request.n_results, request.question)
         )
         return result
+    except IndexNotReady as e:
+        raise not_ready_error(e)
+    except Overloaded as e:
+        raise overloaded_error(e)
+    except asyncio.TimeoutError:
+        raise deadline_error()
     except Exception as e:
         logger.error(f"Quizz error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post('/query')
-async def query_documents(request: PDFRequest):
+async def query_documents(request: PDFRequest, response: Response):
     try:
         logger.info(f"Processing query: {request.query[:50]}...")
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            None, 
-            query_collection,
-            request.query,
-            request.message,
-            request.book,
-            request.n_results
+        key = request_key(
+            normalize_query(request.query), request.message, book_list(request.book), request.n_results,
+            request.conversation_id
         )
+        result = await run_request(query_flights, key, lambda: query_collection(
+            request.query, request.message, request.book, request.n_results, request.conversation_id
+        ))
+        response.headers["X-Cache"] = result["cache"].upper()
         return result
+    except IndexNotReady as e:
+        raise not_ready_error(e)
+    except Overloaded as e:
+        raise overloaded_error(e)
+    except asyncio.TimeoutError:
+        raise deadline_error()
     except Exception as e:
         logger.error(f"Query error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post('/query/stream')
+async def query_documents_stream(request: PDFRequest, http_request: Request):
+    # Fail with a proper status code before the 200 stream starts
+    try:
+        await get_existing_collection()
+    except IndexNotReady as e:
+        raise not_ready_error(e)
+
+    # The admission slot is taken here, so overload is still a 429/503, and held until the stream ends
+    slot = AsyncExitStack()
+    try:
+        await slot.enter_async_context(admission.admit())
+    except Overloaded as e:
+        raise overloaded_error(e)
+
+    logger.info(f"Streaming query: {request.query[:50]}...")
+    deadline = asyncio.get_running_loop().time() + REQUEST_DEADLINE if REQUEST_DEADLINE else None
+
+    async def event_stream():
+        events = stream_query_collection(
+            request.query, request.message, request.book, request.n_results, request.conversation_id
+        )
+        try:
+            async with aclosing(events):
+                while True:
+                    remaining = deadline - asyncio.get_running_loop().time() if deadline else None
+                    try:
+                        event, data = await asyncio.wait_for(anext(events), remaining)
+                    except StopAsyncIteration:
+                        return
+                    except asyncio.TimeoutError:
+                        logger.warning("Stream deadline exceeded, cancelling stream")
+                        yield sse_event("error", {"detail": deadline_error().detail, "status": 504})
+                        return
+                    except Exception as e:
+                        logger.error(f"Stream error: {str(e)}")
+                        yield sse_event("error", {"detail": str(e)})
+                        return
+                    if await http_request.is_disconnected():
+                        logger.info("Client disconnected, cancelling stream")
+                        return
+                    yield sse_event(event, data)
+        finally:
+            await slot.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Releases the slot if the response is abandoned before the stream is iterated
+        background=BackgroundTask(slot.aclose)
+    )
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 7860))
     uvicorn.run(app, host="0.0.0.0", port=port)
@@ -0,0 +1,69 @@
+"""
+Compare two benchmark result files.
+
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+import sys
+import json
+import argparse
+
+# Metrics where a higher value is better; for everything else lower is better
+_HIGHER_IS_BETTER = {"throughput_rps", "chunks_per_sec"}
+
+
+def _change(old, new):
+    if not isinstance(old, (int, float)) or not isinstance(new, (int, float)) or not old:
+        return None
+    return (new - old) / old
+
+
+def _rows(old, new):
+    for metric in ("chunks_per_sec", "seconds", "uploaded_vectors", "unchanged_rerun_seconds", "peak_rss_mb"):
+        yield "ingestion", metric, old.get("ingestion", {}).get(metric), new.get("ingestion", {}).get(metric)
+
+    for endpoint, new_levels in new.get("endpoints", {}).items():
+        old_levels = {level["concurrency"]: level for level in old.get("endpoints", {}).get(endpoint, [])}
+        for level in new_levels:
+            previous = old_levels.get(level["concurrency"], {})
+            for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+                yield f"{endpoint} c={level['concurrency']}", metric, previous.get(metric), level.get(metric)
+
+    yield "memory", "peak_rss_mb", old.get("memory", {}).get("peak_rss_mb"), new.get("memory", {}).get("peak_rss_mb")
+
+
+def compare(old, new, threshold):
+    """Print a side-by-side table and return the rows that got worse by more than `threshold`."""
+    print(f"{'':28} {'metric':24} {old['meta'].get('commit') or 'old':>12} {new['meta'].get('commit') or 'new':>12}  change")
+    regressions = []
+    for group, metric, before, after in _rows(old, new):
+        change = _change(before, after)
+        worse = change is not None and (-change if metric in _HIGHER_IS_BETTER else change) > threshold
+        marker = "  ❌" if worse else ""
+        shown = f"{change:+.1%}" if change is not None else "n/a"
+        print(f"{group:28} {metric:24} {str(before):>12} {str(after):>12}  {shown}{marker}")
+        if worse:
+            regressions.append((group, metric, before, after))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change counted as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 on any regression")
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    regressions = compare(old, new, args.threshold)
+    print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
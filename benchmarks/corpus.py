@@ -0,0 +1,120 @@
+"""Synthetic textbook PDFs for benchmarks, written without any PDF library."""
+import os
+import random
+import argparse
+
+TOPICS = {
+    "computer_science": ["array", "stack", "queue", "linked list", "binary tree", "graph", "hash table", "sorting",
+                         "recursion", "algorithm", "pointer", "compiler", "database", "network", "operating system"],
+    "physics": ["velocity", "acceleration", "force", "momentum", "energy", "friction", "gravity", "wave",
+                "frequency", "optics", "lens", "current", "resistance", "magnetism", "thermodynamics"],
+    "biology": ["cell", "nucleus", "protein", "enzyme", "photosynthesis", "respiration", "gene", "chromosome",
+                "evolution", "ecosystem", "tissue", "hormone", "digestion", "circulation", "reproduction"],
+    "history": ["empire", "dynasty", "trade", "revolution", "constitution", "colony", "treaty", "war",
+                "kingdom", "reform", "independence", "parliament", "monarchy", "migration", "civilisation"],
+}
+_TEMPLATES = [
+    "The {a} is closely related to the {b}, and students should compare them carefully.",
+    "In this chapter we study how a {a} changes when the {b} is increased.",
+    "A common exam question asks why the {a} depends on the {b}.",
+    "Remember that every {a} has properties that distinguish it from a {b}.",
+    "The following example shows the {a} and the {b} working together.",
+    "Historically, the idea of the {a} came before the modern {b}.",
+    "To summarise, the {a} explains most of what we observe about the {b}.",
+]
+_LINE_CHARS = 90
+_LINES_PER_PAGE = 55
+
+
+def _paragraphs(rng, words, count):
+    for _ in range(count):
+        sentences = [rng.choice(_TEMPLATES).format(a=rng.choice(words), b=rng.choice(words)) for _ in range(rng.randint(3, 7))]
+        yield " ".join(sentences)
+
+
+def _page_lines(rng, words):
+    lines = []
+    for paragraph in _paragraphs(rng, words, 12):
+        line = ""
+        for word in paragraph.split():
+            if len(line) + len(word) + 1 > _LINE_CHARS:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}".strip()
+        lines.extend([line, ""])
+        if len(lines) >= _LINES_PER_PAGE:
+            break
+    return lines[:_LINES_PER_PAGE]
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path, pages):
+    """Write a minimal PDF with one Helvetica text page per list of lines."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for lines in pages:
+        content = "BT /F1 10 Tf 13 TL 40 760 Td " + " ".join(f"({_escape(line)}) Tj T*" for line in lines) + " ET"
+        content = content.encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % page_id for page_id in page_ids), len(page_ids)
+    )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def generate_corpus(directory, books=4, pages=20, seed=0, repeated=0.0):
+    """
+    Create `books` PDFs of `pages` pages each; returns [{"filename", "path"}] like download_books().
+    A `repeated` fraction of pages are copies of an earlier page of the same book (exercise boilerplate etc.).
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    subjects = list(TOPICS)
+    files = []
+    for i in range(books):
+        subject = subjects[i % len(subjects)]
+        filename = f"synthetic-{subject}-{i}.pdf"
+        path = os.path.join(directory, filename)
+        book_pages = []
+        for _ in range(pages):
+            if book_pages and rng.random() < repeated:
+                book_pages.append(rng.choice(book_pages))
+            else:
+                book_pages.append(_page_lines(rng, TOPICS[subject]))
+        write_pdf(path, book_pages)
+        files.append({"filename": filename, "path": path})
+    return files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic PDF corpus")
+    parser.add_argument("directory")
+    parser.add_argument("--books", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeated", type=float, default=0.0, help="fraction of pages repeating an earlier page")
+    args = parser.parse_args()
+    for file_info in generate_corpus(args.directory, args.books, args.pages, args.seed, args.repeated):
+        print(f"📄 {file_info['path']}")
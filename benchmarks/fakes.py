@@ -0,0 +1,235 @@
+"""
+In-process stand-ins for Pinecone, Cerebras and the embedding model, with
+configurable latency, plus an ASGI transport that streams response bodies.
+"""
+import re
+import json
+import time
+import asyncio
+import hashlib
+import httpx
+import numpy as np
+from vector_store import VectorStore
+
+
+class FakeEmbeddingModel:
+    """
+    SentenceTransformer-compatible encode() returning deterministic unit
+    vectors derived from word hashes, so similar texts get similar vectors.
+    `latency_ms` is charged per call and `per_text_ms` per text.
+    """
+
+    def __init__(self, dimension=384, latency_ms=0.0, per_text_ms=0.0):
+        self.dimension = dimension
+        self.latency = latency_ms / 1000.0
+        self.per_text = per_text_ms / 1000.0
+
+    def _vector(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            seed = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            vector += np.random.default_rng(seed).standard_normal(self.dimension, dtype=np.float32)
+        if not vector.any():
+            vector[0] = 1.0
+        return vector / np.linalg.norm(vector)
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        time.sleep(self.latency + self.per_text * len(texts))
+        embeddings = np.stack([self._vector(text) for text in texts]) if texts else np.zeros((0, self.dimension))
+        return embeddings[0] if single else embeddings
+
+
+class LatencyStore(VectorStore):
+    """Wraps a real store (normally a LocalStore in a temp dir) and adds network-like latency to every call."""
+
+    def __init__(self, inner, query_latency_ms=30.0, write_latency_ms=50.0):
+        self.inner = inner
+        self.query_latency = query_latency_ms / 1000.0
+        self.write_latency = write_latency_ms / 1000.0
+
+    def upsert(self, vectors, namespace=""):
+        time.sleep(self.write_latency)
+        return self.inner.upsert(vectors, namespace)
+
+    def query(self, vector, top_k=10, filter=None, include_metadata=True, namespace=None):
+        time.sleep(self.query_latency)
+        return self.inner.query(vector, top_k, filter, include_metadata, namespace)
+
+    async def aquery(self, vector, top_k=10, filter=None, include_metadata=True, namespace=None):
+        # Remote latency is spent waiting, not computing, so it doesn't hold a thread.
+        # Multi-namespace queries fan out through the base class, one round trip per namespace.
+        await asyncio.sleep(self.query_latency)
+        return self.inner.query(vector, top_k, filter, include_metadata, namespace)
+
+    def delete(self, ids, namespace=""):
+        time.sleep(self.write_latency)
+        return self.inner.delete(ids, namespace)
+
+    def describe_index_stats(self):
+        time.sleep(self.query_latency)
+        return self.inner.describe_index_stats()
+
+    def namespaces(self):
+        return self.inner.namespaces()
+
+
+class _TokenStream(httpx.AsyncByteStream):
+    def __init__(self, chunks, interval):
+        self._chunks = chunks
+        self._interval = interval
+
+    async def __aiter__(self):
+        for chunk in self._chunks:
+            await asyncio.sleep(self._interval)
+            yield chunk
+
+
+class FakeLLM:
+    """
+    Cerebras/OpenAI-compatible chat completions served through an
+    httpx.MockTransport. A reply costs `latency_ms` before the first token
+    plus `token_ms` per token. Structured-output (quiz) requests get valid
+    question JSON; everything else gets `tokens` words of text.
+    """
+
+    def __init__(self, latency_ms=300.0, token_ms=2.0, tokens=150):
+        self.latency = latency_ms / 1000.0
+        self.token_interval = token_ms / 1000.0
+        self.tokens = tokens
+        self.requests = 0
+        self.prompt_chars = 0
+
+    def client(self):
+        from cerebras.cloud.sdk import AsyncCerebras
+
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(self._handle))
+        # The SDK's warm-up GET uses its own sync client and would bypass the mock transport
+        return AsyncCerebras(
+            api_key="benchmark", base_url="http://fake-llm", http_client=http_client, warm_tcp_connection=False
+        )
+
+    def _quiz(self, prompt, context):
+        match = re.search(r"create (\d+) questions", prompt)
+        count = int(match.group(1)) if match else 10
+        # Seeded by the user message (context), not the shared system prompt, so shards and books differ
+        seed = hashlib.sha1(context.encode()).hexdigest()[:8]
+        return json.dumps({"questions": [
+            {
+                "question": f"Synthetic question {i} about {seed}?",
+                "topic": f"topic {i % 3}",
+                "answer": "Option A",
+                "options": ["Option A", "Option B", "Option C", "Option D"],
+            }
+            for i in range(count)
+        ]})
+
+    async def _handle(self, request):
+        if not request.url.path.endswith("/chat/completions"):
+            # Only chat completions are faked; other SDK endpoints get an empty reply
+            return httpx.Response(200, json={})
+        body = json.loads(request.content)
+        self.requests += 1
+        prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+        self.prompt_chars += len(prompt)
+        context = "\n".join(str(m.get("content", "")) for m in body.get("messages", []) if m.get("role") == "user")
+        content = self._quiz(prompt, context) if body.get("response_format") else " ".join(["token"] * self.tokens)
+        base = {
+            "id": f"bench-{self.requests}", "created": int(time.time()), "model": body.get("model", "fake"),
+            "system_fingerprint": "fake",
+        }
+
+        if body.get("stream"):
+            words = content.split(" ")
+            chunks = [
+                b"data: " + json.dumps({
+                    **base, "object": "chat.completion.chunk",
+                    "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]
+                }).encode() + b"\n\n"
+                for word in words
+            ]
+            chunks.append(b"data: [DONE]\n\n")
+            await asyncio.sleep(self.latency)
+            return httpx.Response(200, headers={"content-type": "text/event-stream"},
+                                  stream=_TokenStream(chunks, self.token_interval))
+
+        await asyncio.sleep(self.latency + self.token_interval * len(content.split(" ")))
+        return httpx.Response(200, json={
+            **base, "object": "chat.completion",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": self.tokens,
+                      "total_tokens": len(prompt) // 4 + self.tokens},
+        })
+
+
+class _QueueStream(httpx.AsyncByteStream):
+    def __init__(self, parts, task):
+        self._parts = parts
+        self._task = task
+
+    async def __aiter__(self):
+        while True:
+            part = await self._parts.get()
+            if part is None:
+                break
+            yield part
+
+    async def aclose(self):
+        if not self._task.done():
+            self._task.cancel()
+
+
+class StreamingASGITransport(httpx.AsyncBaseTransport):
+    """
+    Like httpx.ASGITransport, but the response body is handed to the client
+    as the app sends it instead of after the app finishes, so streaming
+    endpoints can be timed to their first token.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def handle_async_request(self, request):
+        body = await request.aread()
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": request.method,
+            "headers": [(k.lower(), v) for k, v in request.headers.raw], "scheme": request.url.scheme,
+            "path": request.url.path, "raw_path": request.url.raw_path.split(b"?")[0],
+            "query_string": request.url.query, "server": ("bench", 80), "client": ("127.0.0.1", 0), "root_path": "",
+        }
+        started = asyncio.get_running_loop().create_future()
+        parts = asyncio.Queue()
+        received = False
+        disconnected = asyncio.Event()
+
+        async def receive():
+            nonlocal received
+            if not received:
+                received = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                started.set_result((message["status"], message.get("headers", [])))
+            elif message["type"] == "http.response.body":
+                if message.get("body"):
+                    parts.put_nowait(message["body"])
+                if not message.get("more_body", False):
+                    parts.put_nowait(None)
+
+        async def run():
+            try:
+                await self.app(scope, receive, send)
+            except Exception as e:
+                if not started.done():
+                    started.set_exception(e)
+            finally:
+                disconnected.set()
+                parts.put_nowait(None)
+
+        task = asyncio.create_task(run())
+        status, headers = await started
+        return httpx.Response(status, headers=headers, stream=_QueueStream(parts, task))
@@ -0,0 +1,309 @@
+"""
+Offline benchmark: ingests a synthetic corpus into a local index, then
+load-tests the API endpoints against fake Pinecone/Cerebras latency and
+writes the results as JSON.
+
+    python -m benchmarks.run --concurrency 1 8 32 --requests 200
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from collections import Counter
+
+import numpy as np
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark with local stand-ins for Pinecone and Cerebras")
+    parser.add_argument("--books", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=100, help="requests per endpoint and concurrency level")
+    parser.add_argument("--endpoints", nargs="+", default=["query", "query_stream", "quizz", "books"])
+    parser.add_argument("--embedding", choices=["fake", "real"], default="fake",
+                        help="'real' loads EMBEDDING_MODEL, 'fake' hashes words into vectors")
+    parser.add_argument("--embed-latency-ms", type=float, default=5.0, help="fake embedding cost per call")
+    parser.add_argument("--vector-latency-ms", type=float, default=30.0, help="fake index latency per query")
+    parser.add_argument("--vector-write-latency-ms", type=float, default=50.0, help="fake index latency per upsert/delete")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0, help="fake LLM time to first token")
+    parser.add_argument("--llm-token-ms", type=float, default=2.0, help="fake LLM time per generated token")
+    parser.add_argument("--llm-tokens", type=int, default=150, help="fake LLM answer length in tokens")
+    parser.add_argument("--distinct-queries", type=int, default=0,
+                        help="size of the /query question pool (0 = every request unique, no cache hits)")
+    parser.add_argument("--repeated-pages", type=float, default=0.0,
+                        help="fraction of corpus pages that repeat an earlier page, to exercise chunk dedup")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="keep the corpus and indexes here instead of a temp dir")
+    parser.add_argument("--output", help="result file (default benchmarks/results/<time>-<commit>.json)")
+    return parser.parse_args()
+
+
+def configure_environment(workdir, args):
+    """Point every path at the scratch dir and switch off background work; must run before project imports."""
+    os.environ.update({
+        "HF_CACHE_DIR": workdir,
+        "INGEST_MANIFEST_PATH": os.path.join(workdir, "ingest_manifest.sqlite"),
+        "LOCAL_STORE_DIR": os.path.join(workdir, "local_index"),
+        "BOOK_CATALOG_PATH": os.path.join(workdir, "book_catalog.json"),
+        "QUIZ_BANK_PATH": os.path.join(workdir, "quiz_bank.sqlite"),
+        "CHUNK_STORE_DIR": os.path.join(workdir, "chunk_store"),
+        "VECTOR_STORE": "local",
+        "AUTO_INGEST": "false",
+        "QUIZ_BANK_HIGH_WATERMARK": "0",
+        "CEREBRAS_API_KEY": "benchmark",
+    })
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def percentiles(latencies):
+    if not latencies:
+        return {}
+    values = np.asarray(latencies) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "mean_ms": round(float(values.mean()), 2),
+        "max_ms": round(float(values.max()), 2),
+    }
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except Exception:
+        return None, None
+
+
+def bench_ingestion(files, index, embedding_model):
+    import document
+
+    started = time.perf_counter()
+    summary = document.ingest(index=index, embedding_model=embedding_model, downloaded_files=files)
+    elapsed = time.perf_counter() - started
+
+    # Nothing changed, so this measures the manifest skip path
+    started = time.perf_counter()
+    document.ingest(index=index, embedding_model=embedding_model, downloaded_files=files)
+    unchanged = time.perf_counter() - started
+
+    return {
+        "books": len(files),
+        "chunks": summary["chunks"],
+        "uploaded_vectors": summary["uploaded_vectors"],
+        "duplicates_dropped": summary["duplicates_dropped"],
+        "seconds": round(elapsed, 3),
+        "chunks_per_sec": round(summary["chunks"] / elapsed, 1) if elapsed else None,
+        "unchanged_rerun_seconds": round(unchanged, 3),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def request_factory(endpoint, books, args):
+    from benchmarks.corpus import TOPICS
+
+    words = [word for topic in TOPICS.values() for word in topic]
+    rng = random.Random(args.seed)
+    pool = args.distinct_queries
+
+    def question(i):
+        n = i % pool if pool else i
+        return f"Explain how the {words[n % len(words)]} relates to the {words[(n * 7 + 3) % len(words)]} (#{n})"
+
+    if endpoint in ("query", "query_stream"):
+        path = "/query" if endpoint == "query" else "/query/stream"
+        return "POST", path, lambda i: {"query": question(i), "n_results": 5}
+    if endpoint == "query_books":
+        # Course-style query over two books, fanned out across their namespaces
+        return "POST", "/query", lambda i: {"query": question(i), "book": rng.sample(books, min(2, len(books))),
+                                            "n_results": 5}
+    if endpoint == "quizz":
+        return "POST", "/quizz", lambda i: {"book": rng.choice(books) if books else None, "n_results": 5, "question": "5"}
+    if endpoint == "books":
+        return "GET", "/books", None
+    raise ValueError(f"Unknown endpoint '{endpoint}'")
+
+
+async def run_level(client, method, path, make_body, concurrency, total, first=0):
+    """Send requests numbered first..first + total - 1 from `concurrency` workers."""
+    from answer_cache import answer_cache
+
+    latencies = []
+    first_token = []
+    statuses = Counter()
+    numbers = iter(range(first, first + total))
+    cache_before = answer_cache.stats()
+
+    async def worker():
+        for i in numbers:
+            body = make_body(i) if make_body else None
+            started = time.perf_counter()
+            try:
+                if path.endswith("/stream"):
+                    ttft = None
+                    failed = False
+                    async with client.stream(method, path, json=body) as response:
+                        async for line in response.aiter_lines():
+                            if ttft is None and line == "event: token":
+                                ttft = time.perf_counter() - started
+                            elif line == "event: error":
+                                failed = True
+                    status = response.status_code
+                    # The stream has already answered 200 when it fails, so judge it by its events
+                    if status == 200 and failed:
+                        status = "stream_error"
+                    elif status == 200 and ttft is None:
+                        status = "no_tokens"
+                    elif ttft is not None:
+                        first_token.append(ttft)
+                else:
+                    response = await client.request(method, path, json=body)
+                    status = response.status_code
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[str(status)] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    cache_after = answer_cache.stats()
+    result = {
+        "concurrency": concurrency,
+        "requests": total,
+        "throughput_rps": round(total / wall, 2) if wall else None,
+        **percentiles(latencies),
+        "status_codes": dict(statuses),
+        "answer_cache": {key: cache_after[key] - cache_before[key] for key in ("hits_exact", "hits_semantic", "misses")},
+    }
+    if first_token:
+        result["time_to_first_token"] = percentiles(first_token)
+    return result
+
+
+async def bench_endpoints(args, fake_llm):
+    import logging
+    import httpx
+    import query
+    from app import app
+    from benchmarks.fakes import StreamingASGITransport
+
+    # One log line per benchmark request would drown the results
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    query.llm_client = fake_llm.client()
+    results = {}
+    async with app.router.lifespan_context(app):
+        transport = StreamingASGITransport(app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            books = (await client.get("/books")).json().get("books", [])
+            # Request numbers continue across levels and endpoints, so a later level never
+            # replays questions an earlier one left in the answer cache
+            first = 0
+            for endpoint in args.endpoints:
+                method, path, make_body = request_factory(endpoint, books, args)
+                levels = []
+                for concurrency in args.concurrency:
+                    level = await run_level(client, method, path, make_body, concurrency, args.requests, first)
+                    first += args.requests
+                    level["peak_rss_mb"] = peak_rss_mb()
+                    print(f"⏱️ {path} c={concurrency}: p50 {level.get('p50_ms')}ms p95 {level.get('p95_ms')}ms "
+                          f"p99 {level.get('p99_ms')}ms, {level['throughput_rps']} req/s {level['status_codes']} "
+                          f"cache hits {level['answer_cache']['hits_exact'] + level['answer_cache']['hits_semantic']}")
+                    levels.append(level)
+                results[endpoint] = levels
+            stats = (await client.get("/stats")).json()
+    return results, stats
+
+
+def main():
+    args = parse_args()
+    scratch = None
+    if args.workdir:
+        workdir = os.path.abspath(args.workdir)
+        os.makedirs(workdir, exist_ok=True)
+    else:
+        scratch = tempfile.TemporaryDirectory(prefix="wemakedev-bench-")
+        workdir = scratch.name
+    configure_environment(workdir, args)
+
+    # Project modules read config at import time, so they are imported only now
+    import embeddings
+    from vector_store import LocalStore
+    from config import PINECONE_DIMENSION
+    from benchmarks.corpus import generate_corpus
+    from benchmarks.fakes import FakeEmbeddingModel, LatencyStore, FakeLLM
+    import query
+
+    print(f"📚 Generating {args.books} synthetic books of {args.pages} pages in {workdir}")
+    files = generate_corpus(os.path.join(workdir, "corpus"), args.books, args.pages, args.seed, args.repeated_pages)
+
+    if args.embedding == "fake":
+        embeddings._model = FakeEmbeddingModel(PINECONE_DIMENSION, latency_ms=args.embed_latency_ms)
+    embedding_model = embeddings.load_embedding_model()
+    store = LatencyStore(LocalStore(), args.vector_latency_ms, args.vector_write_latency_ms)
+    query.index = store
+    query.embedding_model = embedding_model
+
+    print("🔄 Benchmarking ingestion...")
+    ingestion = bench_ingestion(files, store, embedding_model)
+    print(f"⬆️ {ingestion['chunks']} chunks in {ingestion['seconds']}s ({ingestion['chunks_per_sec']} chunks/s), "
+          f"{ingestion['duplicates_dropped']} near-duplicates skipped")
+
+    fake_llm = FakeLLM(args.llm_latency_ms, args.llm_token_ms, args.llm_tokens)
+    endpoints, stats = asyncio.run(bench_endpoints(args, fake_llm))
+
+    commit, dirty = git_commit()
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "commit": commit,
+            "dirty": dirty,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("output", "workdir")},
+        },
+        "ingestion": ingestion,
+        "endpoints": endpoints,
+        "llm": {
+            "requests": fake_llm.requests,
+            "avg_prompt_chars": round(fake_llm.prompt_chars / fake_llm.requests) if fake_llm.requests else 0,
+        },
+        "memory": {"peak_rss_mb": peak_rss_mb()},
+        "stats": stats,
+    }
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{commit or 'nogit'}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Results saved to {output}")
+
+    if scratch is not None:
+        scratch.cleanup()
+
+
+if __name__ == "__main__":
+    main()
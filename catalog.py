@@ -0,0 +1,84 @@
+import os
+import json
+import time
+import threading
+from config import BOOK_CATALOG_PATH, BOOK_CATALOG_TTL
+
+
+def write_catalog(books, path=BOOK_CATALOG_PATH):
+    """Atomically replace the catalog file. `books` maps book name -> {"chunks", "pages", "updated_at"}."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    payload = {"version": time.time(), "books": books}
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(payload, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+    return payload
+
+
+class BookCatalog:
+    """
+    In-memory view of the book catalog written by document.py.
+
+    Reads are served from memory; the file is re-read only when its mtime
+    changes, and the mtime is checked at most once per `ttl` seconds.
+    """
+
+    def __init__(self, path=BOOK_CATALOG_PATH, ttl=BOOK_CATALOG_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._books = {}
+        self._version = None
+        self._mtime = None
+        # Never checked; 0.0 would look recent on a host booted less than `ttl` seconds ago
+        self._checked_at = float("-inf")
+
+    def _reload_locked(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        with open(self.path) as f:
+            payload = json.load(f)
+        self._books = payload.get("books", {})
+        self._version = payload.get("version")
+        self._mtime = mtime
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.ttl:
+            return
+        with self._lock:
+            self._checked_at = now
+            if force:
+                self._mtime = None
+            self._reload_locked()
+
+    def invalidate(self):
+        """Force the next read to go back to disk."""
+        self._checked_at = float("-inf")
+        self._mtime = None
+
+    def seed(self, books):
+        """Fill an empty catalog (e.g. an index ingested elsewhere) with names found in the index."""
+        with self._lock:
+            if not self._books:
+                self._books = {book: {"chunks": None, "pages": None, "updated_at": None} for book in books}
+
+    def entries(self):
+        self.refresh()
+        return self._books
+
+    def books(self):
+        return sorted(self.entries())
+
+    @property
+    def version(self):
+        self.refresh()
+        return self._version
+
+
+book_catalog = BookCatalog()
@@ -0,0 +1,191 @@
+import os
+import mmap
+import sqlite3
+import threading
+from config import CHUNK_STORE_DIR
+
+_store = None
+_store_lock = threading.Lock()
+
+
+class ChunkStore:
+    """
+    Local chunk text keyed by chunk ID, so vector queries only carry IDs and
+    small metadata.
+
+    Texts are appended as UTF-8 to one blob file and an SQLite table maps each
+    chunk ID to its (offset, length). Reads slice a memory map of the blob, so a
+    lookup is one indexed SELECT plus a decode of exactly the bytes needed.
+    Chunks dropped as near-duplicates at ingestion are kept as aliases of the
+    chunk that was embedded, with their own book and page, so their IDs still
+    resolve and citations can list every page a passage appears on.
+    The blob is append-only: a rewritten chunk gets new bytes and its old ones
+    are left unreferenced, so readers never see bytes change under them. One
+    process writes (ingestion); readers remap the blob when an offset points
+    past what they have mapped.
+    """
+
+    def __init__(self, path=CHUNK_STORE_DIR):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._blob_path = os.path.join(path, "texts.bin")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(path, "chunks.sqlite"), check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                id TEXT PRIMARY KEY,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            )
+        """)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS aliases (
+                id TEXT PRIMARY KEY,
+                canonical_id TEXT NOT NULL,
+                book TEXT NOT NULL,
+                page INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS aliases_by_canonical ON aliases(canonical_id);
+            CREATE INDEX IF NOT EXISTS aliases_by_book ON aliases(book);
+        """)
+        open(self._blob_path, "ab").close()
+        self._map = None
+        self._mapped = 0
+
+    def _remap_locked(self):
+        size = os.path.getsize(self._blob_path)
+        if size == self._mapped:
+            return
+        if self._map is not None:
+            self._map.close()
+        if size == 0:
+            self._map = None
+        else:
+            with open(self._blob_path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mapped = size
+
+    def put(self, items):
+        """Store (chunk_id, text) pairs, replacing any previous text for the same IDs."""
+        if not items:
+            return
+        with self._lock:
+            rows = []
+            with open(self._blob_path, "ab") as blob:
+                offset = blob.tell()
+                for chunk_id, text in items:
+                    data = text.encode("utf-8")
+                    blob.write(data)
+                    rows.append((chunk_id, offset, len(data)))
+                    offset += len(data)
+            # The bytes are on disk before any reader can see their offsets
+            with self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO chunks (id, offset, length) VALUES (?, ?, ?)", rows)
+
+    def set_aliases(self, book, aliases):
+        """Replace a book's duplicate -> canonical mapping; `aliases` maps chunk_id to (canonical_id, page)."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM aliases WHERE book = ?", (book,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO aliases (id, canonical_id, book, page) VALUES (?, ?, ?, ?)",
+                [(chunk_id, canonical_id, book, page) for chunk_id, (canonical_id, page) in aliases.items()]
+            )
+
+    def duplicate_pages(self, ids):
+        """Return {canonical_id: sorted pages of its dropped duplicates} for the given IDs."""
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT canonical_id, page FROM aliases WHERE canonical_id IN ({placeholders})", list(ids)
+            ).fetchall()
+        pages = {}
+        for canonical_id, page in rows:
+            pages.setdefault(canonical_id, set()).add(page)
+        return {canonical_id: sorted(found) for canonical_id, found in pages.items()}
+
+    def get_many(self, ids):
+        """Return {chunk_id: text} for the IDs that are stored, resolving duplicate aliases to their canonical text."""
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            rows = self._conn.execute(f"""
+                SELECT id, offset, length FROM chunks WHERE id IN ({placeholders})
+                UNION ALL
+                SELECT a.id, c.offset, c.length FROM aliases a JOIN chunks c ON c.id = a.canonical_id
+                WHERE a.id IN ({placeholders})
+            """, list(ids) * 2).fetchall()
+            if rows and max(offset + length for _, offset, length in rows) > self._mapped:
+                self._remap_locked()
+            view = memoryview(self._map) if self._map is not None else None
+            try:
+                return {
+                    chunk_id: str(view[offset:offset + length], "utf-8")
+                    for chunk_id, offset, length in rows
+                    if offset + length <= self._mapped
+                }
+            finally:
+                if view is not None:
+                    view.release()
+
+    def delete(self, ids):
+        if not ids:
+            return
+        placeholders = ",".join("?" * len(ids))
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM chunks WHERE id IN ({placeholders})", list(ids))
+            self._conn.execute(
+                f"DELETE FROM aliases WHERE id IN ({placeholders}) OR canonical_id IN ({placeholders})", list(ids) * 2
+            )
+
+    def stats(self):
+        with self._lock:
+            chunks, live_bytes = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks").fetchone()
+            aliases = self._conn.execute("SELECT COUNT(*) FROM aliases").fetchone()[0]
+        return {
+            "chunks": chunks, "aliases": aliases, "live_bytes": live_bytes,
+            "blob_bytes": os.path.getsize(self._blob_path)
+        }
+
+
+def get_chunk_store():
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ChunkStore()
+    return _store
+
+
+def lookup_texts(matches):
+    """
+    Chunk text for each query match, aligned with `matches` (None where
+    unknown). Texts come from the local chunk store, falling back to a "text"
+    metadata field for legacy vectors ingested before the store existed, or
+    written with CHUNK_TEXT_IN_METADATA.
+    """
+    try:
+        stored = get_chunk_store().get_many([match.id for match in matches])
+    except Exception as e:
+        print(f"⚠️ Chunk store unavailable, using metadata text: {e}")
+        stored = {}
+    texts = []
+    for match in matches:
+        text = stored.get(match.id)
+        if text is None and match.metadata:
+            text = match.metadata.get("text")
+        texts.append(text or None)
+    return texts
+
+
+def lookup_duplicate_pages(matches):
+    """{match ID: pages of its dropped near-duplicates} for query matches; empty if the store is unavailable."""
+    try:
+        return get_chunk_store().duplicate_pages([match.id for match in matches])
+    except Exception as e:
+        print(f"⚠️ Chunk store unavailable, skipping duplicate pages: {e}")
+        return {}
+
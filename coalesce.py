@@ -0,0 +1,59 @@
+import json
+import asyncio
+import telemetry
+
+
+def request_key(*parts):
+    """Stable key for a request body; dicts and lists are compared by content."""
+    return json.dumps(parts, sort_keys=True, default=str)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: the first caller for a key runs
+    the coroutine, callers arriving while it is in flight await the same
+    result (or exception). The shared task is cancelled only once every
+    caller waiting on it has gone away.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._flights = {}
+        self.requests = 0
+        self.executions = 0
+
+    async def do(self, key, run):
+        """Return the result of `run()` (a coroutine function), shared with identical in-flight calls."""
+        self.requests += 1
+        flight = self._flights.get(key)
+        telemetry.observe_flight(self.name, flight is not None)
+        if flight is None:
+            self.executions += 1
+            task = asyncio.get_running_loop().create_task(run())
+            flight = self._flights[key] = {"task": task, "waiters": 0}
+            task.add_done_callback(lambda _: self._land(key, flight))
+
+        flight["waiters"] += 1
+        try:
+            return await asyncio.shield(flight["task"])
+        except asyncio.CancelledError:
+            if flight["waiters"] == 1 and not flight["task"].done():
+                flight["task"].cancel()
+            raise
+        finally:
+            flight["waiters"] -= 1
+
+    def _land(self, key, flight):
+        # A later flight for the same key may already have replaced this one
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self):
+        coalesced = self.requests - self.executions
+        return {
+            "requests": self.requests,
+            "executions": self.executions,
+            "coalesced": coalesced,
+            "in_flight": len(self._flights),
+            "coalescing_ratio": round(coalesced / self.requests, 3) if self.requests else 0.0,
+        }
@@ -15,4 +15,133 @@ PINECONE_DIMENSION = int(os.environ.get('PINECONE_DIMENSION', '384'))
 EMBEDDING_MODEL = os.environ.get('EMBEDDING_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
 
 # Cerebras API Configuration
-CEREBRAS_API_KEY = os.environ.get('CEREBRAS_API_KEY')
\ No newline at end of file
+CEREBRAS_API_KEY = os.environ.get('CEREBRAS_API_KEY')
+
+# Ingestion Pipeline Configuration
+INGEST_ENCODE_BATCH_SIZE = int(os.environ.get('INGEST_ENCODE_BATCH_SIZE', '256'))
+INGEST_UPSERT_BATCH_SIZE = int(os.environ.get('INGEST_UPSERT_BATCH_SIZE', '100'))
+INGEST_QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE', '4'))
+INGEST_UPSERT_WORKERS = int(os.environ.get('INGEST_UPSERT_WORKERS', '2'))
+# Worker processes for PDF parsing/chunking (1 = parse in-process) and pages per task
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', '1'))
+INGEST_PAGES_PER_TASK = int(os.environ.get('INGEST_PAGES_PER_TASK', '16'))
+# Content-hash manifest used to skip unchanged books and chunks on re-ingestion
+INGEST_MANIFEST_PATH = os.environ.get('INGEST_MANIFEST_PATH', os.path.join(HF_CACHE_DIR, 'ingest_manifest.sqlite'))
+
+# Vector Store Configuration ('pinecone' or 'local' in-process NumPy index)
+VECTOR_STORE = os.environ.get('VECTOR_STORE', 'pinecone')
+LOCAL_STORE_DIR = os.environ.get('LOCAL_STORE_DIR', os.path.join(HF_CACHE_DIR, 'local_index'))
+LOCAL_STORE_DTYPE = os.environ.get('LOCAL_STORE_DTYPE', 'float32')
+
+# Book catalog written by ingestion and served from memory by the API
+BOOK_CATALOG_PATH = os.environ.get('BOOK_CATALOG_PATH', os.path.join(HF_CACHE_DIR, 'book_catalog.json'))
+BOOK_CATALOG_TTL = float(os.environ.get('BOOK_CATALOG_TTL', '60'))
+
+# Index readiness cache (seconds) and whether to ingest at startup when the index is empty
+INDEX_READY_TTL = float(os.environ.get('INDEX_READY_TTL', '300'))
+INDEX_RETRY_TTL = float(os.environ.get('INDEX_RETRY_TTL', '5'))
+AUTO_INGEST = os.environ.get('AUTO_INGEST', 'true').lower() == 'true'
+
+# Request Path Concurrency
+# Threads dedicated to embedding and to network vector queries
+EMBEDDING_WORKERS = int(os.environ.get('EMBEDDING_WORKERS', '2'))
+RETRIEVAL_WORKERS = int(os.environ.get('RETRIEVAL_WORKERS', '16'))
+# Shared async Cerebras client connection pool and timeout (seconds)
+LLM_MAX_CONNECTIONS = int(os.environ.get('LLM_MAX_CONNECTIONS', '100'))
+LLM_MAX_KEEPALIVE = int(os.environ.get('LLM_MAX_KEEPALIVE', '20'))
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', '60'))
+LLM_MODEL = os.environ.get('LLM_MODEL', 'llama-4-scout-17b-16e-instruct')
+# Micro-batching of concurrent query embeddings (max batch 1 disables batching)
+EMBED_BATCH_MAX_SIZE = int(os.environ.get('EMBED_BATCH_MAX_SIZE', '32'))
+EMBED_BATCH_WAIT_MS = float(os.environ.get('EMBED_BATCH_WAIT_MS', '2'))
+
+# /query answer cache: entry limit (0 disables), TTL in seconds, and cosine
+# similarity needed to reuse an answer for a differently worded query (>1 disables)
+ANSWER_CACHE_SIZE = int(os.environ.get('ANSWER_CACHE_SIZE', '1024'))
+ANSWER_CACHE_TTL = float(os.environ.get('ANSWER_CACHE_TTL', '3600'))
+ANSWER_CACHE_SEMANTIC_THRESHOLD = float(os.environ.get('ANSWER_CACHE_SEMANTIC_THRESHOLD', '0.95'))
+
+# Pre-generated quiz bank: refill a book's pool when it drops below the low
+# watermark, up to the high watermark (0 disables the bank)
+QUIZ_BANK_PATH = os.environ.get('QUIZ_BANK_PATH', os.path.join(HF_CACHE_DIR, 'quiz_bank.sqlite'))
+QUIZ_BANK_LOW_WATERMARK = int(os.environ.get('QUIZ_BANK_LOW_WATERMARK', '20'))
+QUIZ_BANK_HIGH_WATERMARK = int(os.environ.get('QUIZ_BANK_HIGH_WATERMARK', '50'))
+QUIZ_BANK_MAX_SERVES = int(os.environ.get('QUIZ_BANK_MAX_SERVES', '5'))
+QUIZ_BANK_REFILL_INTERVAL = float(os.environ.get('QUIZ_BANK_REFILL_INTERVAL', '300'))
+QUIZ_BANK_WORKERS = int(os.environ.get('QUIZ_BANK_WORKERS', '2'))
+QUIZ_BANK_BATCH_SIZE = int(os.environ.get('QUIZ_BANK_BATCH_SIZE', '10'))
+QUIZ_BANK_CONTEXT_CHUNKS = int(os.environ.get('QUIZ_BANK_CONTEXT_CHUNKS', '5'))
+# Live quizzes larger than QUIZ_SHARD_SIZE questions are generated as concurrent shards
+QUIZ_SHARD_SIZE = int(os.environ.get('QUIZ_SHARD_SIZE', '10'))
+QUIZ_SHARD_RETRIES = int(os.environ.get('QUIZ_SHARD_RETRIES', '2'))
+
+# Prompt budgeting for /query: total prompt tokens, how older history is
+# compacted ('summary' or 'truncate'), and the rolling summary size/cache
+PROMPT_TOKEN_BUDGET = int(os.environ.get('PROMPT_TOKEN_BUDGET', '6000'))
+HISTORY_COMPACTION = os.environ.get('HISTORY_COMPACTION', 'summary')
+HISTORY_SUMMARY_TOKENS = int(os.environ.get('HISTORY_SUMMARY_TOKENS', '300'))
+HISTORY_SUMMARY_CACHE_SIZE = int(os.environ.get('HISTORY_SUMMARY_CACHE_SIZE', '1000'))
+
+# Voice agent job processes: preload the embedding model once and share it
+# copy-on-write across forked job processes, and cap torch threads per process
+AGENT_SHARED_MODEL = os.environ.get('AGENT_SHARED_MODEL', 'false').lower() == 'true'
+AGENT_TORCH_THREADS = int(os.environ.get('AGENT_TORCH_THREADS', '0'))
+
+# Chunk texts are kept in a local store keyed by chunk ID, so vector metadata
+# (returned with every query) stays small. CHUNK_TEXT_IN_METADATA=true also
+# copies them into metadata, an explicit opt-in for serving hosts without the
+# ingestion host's store; readiness fails, and ingestion refills the store,
+# when the store is empty but the index is not
+CHUNK_STORE_DIR = os.environ.get('CHUNK_STORE_DIR', os.path.join(HF_CACHE_DIR, 'chunk_store'))
+CHUNK_TEXT_IN_METADATA = os.environ.get('CHUNK_TEXT_IN_METADATA', 'false').lower() == 'true'
+
+# Retrieved chunks are stitched and de-duplicated into at most this many
+# context tokens (0 disables the limit); passages whose word shingles are at
+# least this covered by a better-ranked passage are dropped as near-duplicates
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '3000'))
+CONTEXT_DUPLICATE_THRESHOLD = float(os.environ.get('CONTEXT_DUPLICATE_THRESHOLD', '0.8'))
+
+# Admission control for /query, /query/stream and /quizz: requests running at
+# once (0 disables), requests allowed to wait for a slot and for how long
+# (seconds), and the deadline after which a request is cancelled with a 504
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('MAX_CONCURRENT_REQUESTS', '32'))
+REQUEST_QUEUE_SIZE = int(os.environ.get('REQUEST_QUEUE_SIZE', '64'))
+REQUEST_QUEUE_TIMEOUT = float(os.environ.get('REQUEST_QUEUE_TIMEOUT', '10'))
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', '60'))
+# Concurrent calls allowed into each downstream stage (0 = unlimited)
+EMBEDDING_CONCURRENCY = int(os.environ.get('EMBEDDING_CONCURRENCY', '64'))
+RETRIEVAL_CONCURRENCY = int(os.environ.get('RETRIEVAL_CONCURRENCY', '16'))
+LLM_CONCURRENCY = int(os.environ.get('LLM_CONCURRENCY', '32'))
+
+# Observability: Prometheus histograms on /metrics, a Server-Timing header
+# with per-stage durations on every response, and the fraction of LLM
+# prompts printed to the log (0 = never)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'false').lower() == 'true'
+PROMPT_LOG_SAMPLE_RATE = float(os.environ.get('PROMPT_LOG_SAMPLE_RATE', '0'))
+
+# Embedding backend: 'torch' runs the SentenceTransformer, 'onnx' runs an
+# ONNX export of EMBEDDING_MODEL (int8-quantized by default) through ONNX
+# Runtime; export it with `python onnx_embedding.py export`
+EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'torch')
+ONNX_MODEL_DIR = os.environ.get(
+    'ONNX_MODEL_DIR', os.path.join(HF_CACHE_DIR, 'onnx', EMBEDDING_MODEL.replace('/', '--'))
+)
+ONNX_QUANTIZE = os.environ.get('ONNX_QUANTIZE', 'true').lower() == 'true'
+ONNX_THREADS = int(os.environ.get('ONNX_THREADS', '0'))
+# Minimum cosine similarity between ONNX and torch embeddings for the export to pass
+EMBEDDING_PARITY_THRESHOLD = float(os.environ.get('EMBEDDING_PARITY_THRESHOLD', '0.99'))
+
+# Near-duplicate chunk elimination during ingestion (MinHash/LSH, per book):
+# chunks whose estimated Jaccard similarity to an earlier chunk of the same
+# book reaches DEDUP_THRESHOLD are not embedded; citations map them to the kept chunk
+DEDUP_ENABLED = os.environ.get('DEDUP_ENABLED', 'true').lower() == 'true'
+DEDUP_THRESHOLD = float(os.environ.get('DEDUP_THRESHOLD', '0.85'))
+DEDUP_NUM_PERM = int(os.environ.get('DEDUP_NUM_PERM', '128'))
+DEDUP_SHINGLE_SIZE = int(os.environ.get('DEDUP_SHINGLE_SIZE', '5'))
+
+# Write each book into its own vector store namespace (Pinecone namespace,
+# LocalStore partition) so book-scoped queries only search that book and
+# multi-book queries fan out concurrently; false keeps one flat namespace
+# filtered by book metadata
+VECTOR_NAMESPACES = os.environ.get('VECTOR_NAMESPACES', 'true').lower() == 'true'
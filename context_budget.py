@@ -0,0 +1,125 @@
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from config import PROMPT_TOKEN_BUDGET, HISTORY_COMPACTION, HISTORY_SUMMARY_TOKENS, HISTORY_SUMMARY_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception as e:
+    _encoding = None
+    # Logged once at import: every prompt budget below is then only an estimate
+    logger.warning(f"⚠️ tiktoken unavailable ({e}), estimating prompt tokens as characters / 4")
+
+# Per-message overhead for role/separator tokens in chat templates
+_MESSAGE_OVERHEAD = 4
+
+
+def count_tokens(text):
+    """Token count with tiktoken when installed, otherwise a ~4 characters/token estimate."""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def message_tokens(message):
+    content = message.get("content", "")
+    if not isinstance(content, str):
+        content = json.dumps(content)
+    return count_tokens(content) + _MESSAGE_OVERHEAD
+
+
+def _prefix_digest(turns):
+    return hashlib.sha1(json.dumps(turns, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class HistoryCompactor:
+    """
+    Fits conversation history into what is left of the prompt budget after
+    the system prompt, retrieved context and question.
+
+    The newest turns are kept verbatim. Older turns are dropped ("truncate"),
+    or folded into a rolling summary ("summary") cached per conversation ID.
+    Because clients resend the full history each turn, the cache remembers how
+    many leading turns it already covers and only summarizes the new ones.
+    """
+
+    def __init__(self, budget=PROMPT_TOKEN_BUDGET, mode=HISTORY_COMPACTION,
+                 summary_tokens=HISTORY_SUMMARY_TOKENS, max_conversations=HISTORY_SUMMARY_CACHE_SIZE):
+        self.budget = budget
+        self.mode = mode
+        self.summary_tokens = summary_tokens
+        self.max_conversations = max_conversations
+        self._lock = threading.Lock()
+        # conversation_id -> (covered turn count, digest of covered turns, summary)
+        self._summaries = OrderedDict()
+
+    def _cached_summary(self, conversation_id):
+        with self._lock:
+            entry = self._summaries.get(conversation_id)
+            if entry is not None:
+                self._summaries.move_to_end(conversation_id)
+            return entry
+
+    def _store_summary(self, conversation_id, covered, digest, summary):
+        with self._lock:
+            self._summaries[conversation_id] = (covered, digest, summary)
+            self._summaries.move_to_end(conversation_id)
+            while len(self._summaries) > self.max_conversations:
+                self._summaries.popitem(last=False)
+
+    async def compact(self, history, fixed_tokens, conversation_id=None, summarize=None):
+        """
+        Return (messages, info) where messages replace `history` in the prompt.
+
+        `summarize(previous_summary, turns)` is a coroutine returning a summary
+        string; it is only called in "summary" mode with a conversation ID.
+        """
+        history = list(history or [])
+        available = max(self.budget - fixed_tokens, 0)
+        sizes = [message_tokens(m) for m in history]
+        info = {"history_turns": len(history), "kept_turns": len(history), "summarized_turns": 0}
+        if sum(sizes) <= available:
+            return history, info
+
+        use_summary = self.mode == "summary" and conversation_id and summarize is not None
+        keep_budget = available - (self.summary_tokens + _MESSAGE_OVERHEAD if use_summary else 0)
+
+        cut = len(history)
+        kept_tokens = 0
+        while cut > 0 and kept_tokens + sizes[cut - 1] <= keep_budget:
+            cut -= 1
+            kept_tokens += sizes[cut]
+        kept = history[cut:]
+        info["kept_turns"] = len(kept)
+
+        if not use_summary or cut == 0:
+            return kept, info
+
+        dropped = history[:cut]
+        digest = _prefix_digest(dropped)
+        cached = self._cached_summary(conversation_id)
+        try:
+            if cached and cached[0] == cut and cached[1] == digest:
+                summary = cached[2]
+            elif cached and cached[0] < cut and cached[1] == _prefix_digest(dropped[:cached[0]]):
+                summary = await summarize(cached[2], dropped[cached[0]:])
+            else:
+                summary = await summarize(None, dropped)
+        except Exception as e:
+            print(f"⚠️ History summary failed, truncating instead: {e}")
+            return kept, info
+
+        self._store_summary(conversation_id, cut, digest, summary)
+        info["summarized_turns"] = cut
+        summary_message = {"role": "system", "content": f"Summary of the earlier conversation: {summary}"}
+        return [summary_message] + kept, info
+
+
+history_compactor = HistoryCompactor()
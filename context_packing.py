@@ -0,0 +1,117 @@
+import re
+from context_budget import count_tokens
+from config import CONTEXT_TOKEN_BUDGET, CONTEXT_DUPLICATE_THRESHOLD
+
+# Shortest suffix/prefix match treated as splitter overlap rather than coincidence
+_MIN_OVERLAP = 20
+# Chunks overlap by at most CHUNK_OVERLAP characters; leave slack for whitespace the splitter trims
+_MAX_OVERLAP = 400
+_SHINGLE_WORDS = 5
+
+
+def _overlap(previous, following):
+    """Length of the longest suffix of `previous` that is also a prefix of `following`."""
+    for size in range(min(len(previous), len(following), _MAX_OVERLAP), _MIN_OVERLAP - 1, -1):
+        if previous.endswith(following[:size]):
+            return size
+    return 0
+
+
+def _shingles(text):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= _SHINGLE_WORDS:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + _SHINGLE_WORDS]) for i in range(len(words) - _SHINGLE_WORDS + 1)}
+
+
+def _stitch(group):
+    """Merge one page's chunks into passages, joining consecutive chunk numbers without their overlap."""
+    group.sort(key=lambda item: item["chunk"])
+    passages = [dict(group[0])]
+    for item in group[1:]:
+        last = passages[-1]
+        if item["chunk"] == last["last_chunk"] + 1:
+            cut = _overlap(last["text"], item["text"])
+            separator = "" if cut else " "
+            last["text"] = last["text"] + separator + item["text"][cut:]
+            last["last_chunk"] = item["chunk"]
+            last["score"] = max(last["score"], item["score"])
+            last["chunks"] += 1
+        else:
+            passages.append(dict(item))
+    return passages
+
+
+def pack_contexts(matches, texts, budget=CONTEXT_TOKEN_BUDGET, duplicate_threshold=CONTEXT_DUPLICATE_THRESHOLD):
+    """
+    Turn retrieved chunks into prompt context of at most `budget` tokens.
+
+    Chunks from the same book page with consecutive chunk numbers are stitched
+    into one passage with the splitter's overlap removed. Passages whose word
+    shingles are mostly covered by a better-ranked passage are dropped as
+    near-duplicates. The rest are added best score first while they fit the
+    budget (0 disables the limit). Returns (context, info).
+    """
+    items = []
+    for match, text in zip(matches, texts):
+        if not text:
+            continue
+        metadata = match.metadata or {}
+        # Pinecone returns numeric metadata as floats
+        page = metadata.get("page_number")
+        page = int(page) if isinstance(page, (int, float)) else None
+        chunk = metadata.get("chunk_number")
+        chunk = int(chunk) if isinstance(chunk, (int, float)) else None
+        items.append({
+            "text": text,
+            "book": metadata.get("book", "unknown"),
+            "page": page,
+            "chunk": chunk,
+            "last_chunk": chunk,
+            "score": match.score or 0.0,
+            "chunks": 1,
+        })
+
+    groups = {}
+    passages = []
+    for item in items:
+        if item["page"] is None or item["chunk"] is None:
+            passages.append(item)
+        else:
+            groups.setdefault((item["book"], item["page"]), []).append(item)
+    for group in groups.values():
+        passages.extend(_stitch(group))
+    passages.sort(key=lambda passage: passage["score"], reverse=True)
+
+    kept = []
+    kept_shingles = []
+    duplicates = 0
+    for passage in passages:
+        shingles = _shingles(passage["text"])
+        if shingles and any(len(shingles & other) / len(shingles) >= duplicate_threshold for other in kept_shingles):
+            duplicates += 1
+            continue
+        kept.append(passage)
+        kept_shingles.append(shingles)
+
+    blocks = []
+    used = 0
+    for passage in kept:
+        # Same page numbers as the response's sources[].page so cited pages line up
+        label = f"[{passage['book']}" + (f", page {passage['page']}]" if passage["page"] is not None else "]")
+        block = f"{label}\n{passage['text']}"
+        tokens = count_tokens(block)
+        # The best passage is always kept, even if it alone exceeds the budget
+        if budget and blocks and used + tokens > budget:
+            continue
+        blocks.append(block)
+        used += tokens
+
+    info = {
+        "chunks": len(items),
+        "passages": len(passages),
+        "duplicates_dropped": duplicates,
+        "passages_used": len(blocks),
+        "context_tokens": used,
+    }
+    return "\n\n".join(blocks), info
@@ -0,0 +1,84 @@
+import re
+import zlib
+import hashlib
+import numpy as np
+from config import DEDUP_THRESHOLD, DEDUP_NUM_PERM, DEDUP_SHINGLE_SIZE
+
+# Mersenne prime for the (a * x + b) mod p permutations; a * x stays below 2**63
+_PRIME = (1 << 31) - 1
+
+
+def lsh_bands(num_perm, threshold, recall=0.95):
+    """
+    Pick (bands, rows) for banding a num_perm signature: the most rows per band
+    (fewest false candidates) that still makes a pair exactly at `threshold` a
+    candidate with probability `recall`. Candidates are verified afterwards.
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        if 1 - (1 - threshold ** rows) ** bands >= recall:
+            best = (bands, rows)
+    return best
+
+
+class NearDuplicateFilter:
+    """
+    MinHash/LSH near-duplicate detection over chunk texts.
+
+    Each text becomes a set of word shingles and a MinHash signature; texts
+    sharing any LSH band bucket are compared by estimated Jaccard similarity.
+    The first text seen is the canonical one and later texts at or above
+    `threshold` are reported as its duplicates. Exact repeats (after
+    lowercasing and collapsing whitespace) are caught by hash before any
+    MinHash work.
+    """
+
+    def __init__(self, threshold=DEDUP_THRESHOLD, num_perm=DEDUP_NUM_PERM, shingle_size=DEDUP_SHINGLE_SIZE, seed=1):
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)
+        self.bands, self.rows = lsh_bands(num_perm, threshold)
+        self.reset()
+
+    def reset(self):
+        """Forget every canonical text, e.g. before moving on to the next book."""
+        self._exact = {}
+        self._signatures = {}
+        self._buckets = [{} for _ in range(self.bands)]
+
+    def signature(self, words):
+        n = self.shingle_size
+        shingles = {" ".join(words[i:i + n]) for i in range(max(len(words) - n + 1, 1))}
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        return ((np.outer(self._a, hashes) + self._b[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def duplicate_of(self, chunk_id, text):
+        """Return the canonical chunk ID `text` duplicates, or None after registering it as canonical."""
+        words = re.findall(r"\w+", text.lower())
+        exact = hashlib.sha1(" ".join(words).encode("utf-8")).digest()
+        canonical = self._exact.get(exact)
+        if canonical is not None:
+            return canonical
+
+        signature = self.signature(words)
+        keys = self._band_keys(signature)
+        checked = set()
+        for bucket, key in zip(self._buckets, keys):
+            for candidate in bucket.get(key, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                if np.mean(self._signatures[candidate] == signature) >= self.threshold:
+                    return candidate
+
+        self._exact[exact] = chunk_id
+        self._signatures[chunk_id] = signature
+        for bucket, key in zip(self._buckets, keys):
+            bucket.setdefault(key, []).append(chunk_id)
+        return None
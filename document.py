@@ -1,98 +1,468 @@
 import os
 import time
+import queue
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from pypdf import PdfReader
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from pinecone import Pinecone, ServerlessSpec
-from sentence_transformers import SentenceTransformer
 from huggingface_hub import hf_hub_download, list_repo_files
-from config import HF_CACHE_DIR, PINECONE_API_KEY, PINECONE_INDEX_NAME, PINECONE_DIMENSION, EMBEDDING_MODEL, HF_TOKEN
+from manifest import IngestManifest, file_sha256, chunk_hash
+from vector_store import open_vector_store, book_namespace
+from catalog import write_catalog
+from chunk_store import get_chunk_store
+from dedup import NearDuplicateFilter
+from embeddings import load_embedding_model
+from telemetry import span
+from config import (
+    HF_CACHE_DIR, HF_TOKEN,
+    INGEST_ENCODE_BATCH_SIZE, INGEST_UPSERT_BATCH_SIZE, INGEST_QUEUE_SIZE, INGEST_UPSERT_WORKERS,
+    INGEST_WORKERS, INGEST_PAGES_PER_TASK, CHUNK_TEXT_IN_METADATA, DEDUP_ENABLED
+)
 
 repo_id = "Navanihk/books"
-os.makedirs(HF_CACHE_DIR, exist_ok=True)
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
 
-print("🔧 Initializing Pinecone...")
-pc = Pinecone(api_key=PINECONE_API_KEY)
+# Marks the end of the chunk stream on the reader -> encoder queue
+_END_OF_STREAM = object()
 
-if HF_TOKEN:
-    os.environ['HF_TOKEN'] = HF_TOKEN
 
-print(f"🤖 Loading embedding model: {EMBEDDING_MODEL}")
-embedding_model = SentenceTransformer(EMBEDDING_MODEL)
+def download_books():
+    """Returns (downloaded_files, complete); complete is False if the listing or any download failed."""
+    print("📚 Fetching books from Hugging Face...")
+    complete = True
+    try:
+        repo_files = list_repo_files(repo_id=repo_id, token=HF_TOKEN)
+        pdf_files = [f for f in repo_files if f.endswith('.pdf')]
+    except Exception:
+        pdf_files = ["tamilNadu-computerScience.pdf"]
+        complete = False
 
-print(f"📊 Setting up Pinecone index: {PINECONE_INDEX_NAME}")
-existing_indexes = pc.list_indexes()
-index_names = [idx['name'] for idx in existing_indexes.indexes]
+    downloaded_files = []
+    for pdf_file in pdf_files:
+        try:
+            pdf_path = hf_hub_download(repo_id=repo_id, filename=pdf_file, cache_dir=HF_CACHE_DIR, token=HF_TOKEN)
+            downloaded_files.append({"filename": pdf_file, "path": pdf_path})
+            print(f"✅ Downloaded {pdf_file}")
+        except Exception as e:
+            print(f"❌ Failed to download {pdf_file}: {e}")
+            complete = False
+    return downloaded_files, complete
 
-if PINECONE_INDEX_NAME not in index_names:
-    print(f"📝 Creating new index '{PINECONE_INDEX_NAME}'")
-    pc.create_index(
-        name=PINECONE_INDEX_NAME,
-        dimension=PINECONE_DIMENSION,
-        metric="cosine",
-        spec=ServerlessSpec(cloud="aws", region="us-east-1")
-    )
-    time.sleep(10)
 
-index = pc.Index(PINECONE_INDEX_NAME)
-print(f"🔗 Connected to Pinecone index")
+def select_changed_files(downloaded_files, manifest, everything=False):
+    changed = []
+    for file_info in downloaded_files:
+        sha256 = file_sha256(file_info["path"])
+        filename = file_info["filename"]
+        if not everything and manifest.file_unchanged(filename, sha256, book_namespace(filename)):
+            print(f"⏭️ {file_info['filename']} unchanged, skipping")
+            continue
+        changed.append({**file_info, "sha256": sha256})
+    return changed
 
-print("📚 Fetching books from Hugging Face...")
-try:
-    repo_files = list_repo_files(repo_id=repo_id, token=HF_TOKEN)
-    pdf_files = [f for f in repo_files if f.endswith('.pdf')]
-except Exception:
-    pdf_files = ["tamilNadu-computerScience.pdf"]
 
-downloaded_files = []
-for pdf_file in pdf_files:
-    try:
-        pdf_path = hf_hub_download(repo_id=repo_id, filename=pdf_file, cache_dir=HF_CACHE_DIR, token=HF_TOKEN)
-        downloaded_files.append({"filename": pdf_file, "path": pdf_path})
-        print(f"✅ Downloaded {pdf_file}")
-    except Exception as e:
-        print(f"❌ Failed to download {pdf_file}: {e}")
+def filter_changed_chunks(chunk_iter, manifest, seen, pages, progress=None, duplicates=None, restore_texts=False):
+    """
+    Pass through only chunks whose text differs from what the manifest recorded.
+
+    The hash of every kept chunk, changed or not, is collected into
+    seen[filename] so stale chunk IDs can be found once the file has been fully
+    processed, and the pages that produced text are collected into
+    pages[filename]. If `duplicates` is a dict, near-duplicates of an earlier
+    chunk of the same book are dropped before embedding and recorded as
+    duplicates[filename][chunk_id] = (canonical_id, page). Their IDs stay out
+    of `seen`, so a chunk that was embedded on an earlier run and is now a
+    duplicate gets deleted as stale. With `restore_texts`, unchanged chunks
+    are not re-embedded but their texts are written back to the chunk store.
+    """
+    near_duplicates = NearDuplicateFilter() if duplicates is not None else None
+    restored = []
+    current_file = None
+    previous = {}
+    for chunk_id, text, metadata in chunk_iter:
+        filename = metadata["book"]
+        if filename != current_file:
+            current_file = filename
+            previous = manifest.chunk_hashes(filename, book_namespace(filename))
+            seen.setdefault(filename, {})
+            if progress:
+                progress(current_book=filename, books_started=len(seen))
+            pages.setdefault(filename, set())
+            if near_duplicates is not None:
+                near_duplicates.reset()
+                duplicates.setdefault(filename, {})
+        pages[filename].add(metadata["page_number"])
+        if near_duplicates is not None:
+            with span("ingest_dedup"):
+                canonical_id = near_duplicates.duplicate_of(chunk_id, text)
+            if canonical_id is not None:
+                duplicates[filename][chunk_id] = (canonical_id, metadata["page_number"])
+                continue
+        digest = chunk_hash(text)
+        seen[filename][chunk_id] = digest
+        if previous.get(chunk_id) == digest:
+            if restore_texts:
+                restored.append((chunk_id, text))
+                if len(restored) >= INGEST_ENCODE_BATCH_SIZE:
+                    get_chunk_store().put(restored)
+                    restored = []
+            continue
+        yield chunk_id, text, metadata
+    get_chunk_store().put(restored)
+
+
+def delete_vectors(index, ids, namespace="", batch_size=1000):
+    for i in range(0, len(ids), batch_size):
+        index.delete(ids[i:i + batch_size], namespace=namespace)
+        get_chunk_store().delete(ids[i:i + batch_size])
+    if ids:
+        print(f"🗑️ Deleted {len(ids)} stale vectors")
+
+
+def delete_from_index(index, ids, namespace, batch_size=1000):
+    """Delete vectors but keep their chunk texts, for IDs that are re-uploaded elsewhere."""
+    for i in range(0, len(ids), batch_size):
+        index.delete(ids[i:i + batch_size], namespace=namespace)
+
+
+def move_namespaces(index, manifest, changed_files):
+    """
+    Delete the vectors of books last written to a different namespace (e.g.
+    the flat layout from before VECTOR_NAMESPACES). Their manifest hashes no
+    longer match the book's namespace, so every chunk is uploaded again.
+    Chunk texts stay in the chunk store; the re-upload overwrites them.
+    """
+    for file_info in changed_files:
+        filename = file_info["filename"]
+        previous = manifest.namespace(filename)
+        if previous is None or previous == book_namespace(filename):
+            continue
+        print(f"🔀 Moving {filename} from namespace '{previous}' to '{book_namespace(filename)}'")
+        delete_from_index(index, manifest.chunk_ids(filename), previous)
+
+
+def update_manifest(index, manifest, changed_files, seen, pages, duplicates):
+    # Default-namespace vectors that no manifest entry accounts for were written by a run whose manifest
+    # is lost; books the manifest records there are moved by move_namespaces, and new books have none
+    untracked_flat = "" in index.namespaces() and not any(manifest.namespace(f) == "" for f in manifest.filenames())
+    for file_info in changed_files:
+        filename = file_info["filename"]
+        if filename not in seen:
+            print(f"⚠️ No chunks produced for {filename}, leaving its manifest entry untouched")
+            continue
+        current = seen[filename]
+        namespace = book_namespace(filename)
+        if namespace and untracked_flat and manifest.namespace(filename) is None:
+            # Nothing recorded where this book went before (lost manifest, or vectors older than it), so
+            # clear copies a flat-layout run may have left in the default namespace; chunk IDs are deterministic
+            delete_from_index(index, list(current) + list(duplicates.get(filename, {})), "")
+        stale = [chunk_id for chunk_id in manifest.chunk_ids(filename) if chunk_id not in current]
+        # After a namespace move the old vectors are already gone; this only clears their texts
+        delete_vectors(index, stale, namespace)
+        get_chunk_store().set_aliases(filename, duplicates.get(filename, {}))
+        manifest.record_file(filename, file_info["sha256"], current, len(pages[filename]), namespace)
+
+
+def prune_removed_files(index, manifest, downloaded_files):
+    present = {file_info["filename"] for file_info in downloaded_files}
+    for filename in manifest.filenames():
+        if filename not in present:
+            print(f"🗑️ {filename} was removed from {repo_id}")
+            delete_vectors(index, manifest.chunk_ids(filename), manifest.namespace(filename) or "")
+            manifest.remove_file(filename)
 
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-print("🔄 Processing documents...")
 
-all_vectors = []
-batch_size = 100
+def iter_chunks(downloaded_files, text_splitter):
+    """Yield (chunk_id, text, metadata) one page at a time, never holding more than a page in memory."""
+    for file_info in downloaded_files:
+        filename = file_info["filename"]
+        file_path = file_info["path"]
 
-for file_info in downloaded_files:
-    filename = file_info["filename"]
-    file_path = file_info["path"]
-    
-    loader = PyPDFLoader(file_path)
-    print(f"📖 Processing {filename}...")
+        loader = PyPDFLoader(file_path)
+        print(f"📖 Processing {filename}...")
 
-    for page_num, page in enumerate(loader.lazy_load()):
-        chunks = text_splitter.split_text(page.page_content)
-        
-        for chunk_num, chunk in enumerate(chunks):
+        for page_num, page in enumerate(loader.lazy_load()):
+            chunks = text_splitter.split_text(page.page_content)
+
+            for chunk_num, chunk in enumerate(chunks):
+                chunk_id = f"{filename}_page_{page_num}_chunk_{chunk_num}"
+                metadata = {
+                    "page_number": page_num,
+                    "chunk_number": chunk_num,
+                    "source": file_path,
+                    "book": filename
+                }
+                yield chunk_id, chunk, metadata
+
+
+def _chunk_page_range(filename, file_path, start, end):
+    """Worker: extract and split pages [start, end) of one PDF, returning chunks in page order."""
+    reader = PdfReader(file_path)
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    results = []
+    for page_num in range(start, end):
+        # Same extraction PyPDFLoader uses, so chunk text and IDs match the serial path
+        page_text = reader.pages[page_num].extract_text()
+        for chunk_num, chunk in enumerate(text_splitter.split_text(page_text)):
             chunk_id = f"{filename}_page_{page_num}_chunk_{chunk_num}"
-            embedding = embedding_model.encode(chunk).tolist()
-            
             metadata = {
-                "text": chunk,
                 "page_number": page_num,
                 "chunk_number": chunk_num,
                 "source": file_path,
                 "book": filename
             }
-            
-            vector = {"id": chunk_id, "values": embedding, "metadata": metadata}
-            all_vectors.append(vector)
-
-print(f"⬆️ Uploading {len(all_vectors)} vectors...")
-for i in range(0, len(all_vectors), batch_size):
-    batch = all_vectors[i:i + batch_size]
-    index.upsert(vectors=batch)
-    print(f"✅ Uploaded batch {i//batch_size + 1}")
-
-final_stats = index.describe_index_stats()
-print(f"🎉 Complete! Total vectors: {final_stats.total_vector_count}")
-
-# Test query
-query_embedding = embedding_model.encode("what is array").tolist()
-results = index.query(vector=query_embedding, top_k=2, include_metadata=True)
-print(f"📊 Test query found {len(results.matches)} results")
\ No newline at end of file
+            results.append((chunk_id, chunk, metadata))
+    return results
+
+
+def _page_range_tasks(downloaded_files):
+    for file_info in downloaded_files:
+        filename = file_info["filename"]
+        file_path = file_info["path"]
+        try:
+            page_count = len(PdfReader(file_path).pages)
+        except Exception as e:
+            print(f"❌ Failed to open {filename}: {e}")
+            continue
+        print(f"📖 Processing {filename} ({page_count} pages)...")
+        for start in range(0, page_count, INGEST_PAGES_PER_TASK):
+            yield filename, file_path, start, min(start + INGEST_PAGES_PER_TASK, page_count)
+
+
+def iter_chunks_parallel(downloaded_files, workers):
+    """
+    Same output as iter_chunks, but pages are parsed and split by a process pool.
+
+    Work is fanned out per file and page range; results are consumed strictly in
+    submission order so chunk IDs and ordering match the serial path. Only a
+    window of 2 * workers tasks is in flight to keep memory bounded.
+    """
+    # Spawned, not forked: this runs on the reader thread next to the encode/upsert threads (and in the API
+    # next to uvicorn's), and a forked child can inherit torch, SQLite or HTTP locks held by those threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending = deque()
+        for task in _page_range_tasks(downloaded_files):
+            pending.append(pool.submit(_chunk_page_range, *task))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def _read_batches(chunk_iter, batch_queue, stop_event):
+    """Reader stage: group chunks into encode batches and hand them to the encoder."""
+    try:
+        batch = []
+        for item in chunk_iter:
+            if stop_event.is_set():
+                return
+            batch.append(item)
+            if len(batch) >= INGEST_ENCODE_BATCH_SIZE:
+                batch_queue.put(batch)
+                batch = []
+        if batch:
+            batch_queue.put(batch)
+        batch_queue.put(_END_OF_STREAM)
+    except Exception as e:
+        batch_queue.put(e)
+
+
+def run_ingestion(index, embedding_model, chunk_iter, progress=None):
+    """
+    Stream chunks through read -> encode -> upsert.
+
+    Each stage runs on its own thread(s) and the stages are joined by bounded
+    queues, so peak memory is set by the batch and queue sizes instead of the
+    corpus size, and the slowest stage sets the overall pace.
+    """
+    batch_queue = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+    chunk_store = get_chunk_store()
+    stop_event = threading.Event()
+    reader = threading.Thread(target=_read_batches, args=(chunk_iter, batch_queue, stop_event), daemon=True)
+    reader.start()
+
+    # Caps the number of upsert batches that are encoded but not yet uploaded
+    upsert_slots = threading.BoundedSemaphore(INGEST_QUEUE_SIZE * INGEST_UPSERT_WORKERS)
+    upsert_errors = []
+    uploaded = 0
+    upload_lock = threading.Lock()
+
+    def upsert(vectors, namespace, batch_num):
+        nonlocal uploaded
+        try:
+            with span("ingest_upsert"):
+                index.upsert(vectors=vectors, namespace=namespace)
+            with upload_lock:
+                uploaded += len(vectors)
+                total = uploaded
+            print(f"✅ Uploaded batch {batch_num}")
+            if progress:
+                progress(uploaded=total)
+        except Exception as e:
+            upsert_errors.append(e)
+        finally:
+            upsert_slots.release()
+
+    batch_num = 0
+    with ThreadPoolExecutor(max_workers=INGEST_UPSERT_WORKERS) as upsert_pool:
+        try:
+            while True:
+                # Time spent here means parsing/chunking is the bottleneck
+                with span("ingest_wait_chunks"):
+                    batch = batch_queue.get()
+                if batch is _END_OF_STREAM:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                if upsert_errors:
+                    raise upsert_errors[0]
+
+                texts = [text for _, text, _ in batch]
+                with span("ingest_encode"):
+                    embeddings = embedding_model.encode(texts, batch_size=64, convert_to_numpy=True)
+
+                # Texts land in the chunk store before their vectors become queryable
+                with span("ingest_chunk_store"):
+                    chunk_store.put([(chunk_id, text) for chunk_id, text, _ in batch])
+                # A batch can span two books, and every upsert goes to a single namespace
+                by_namespace = {}
+                for (chunk_id, text, metadata), embedding in zip(batch, embeddings):
+                    by_namespace.setdefault(book_namespace(metadata["book"]), []).append({
+                        "id": chunk_id,
+                        "values": embedding.tolist(),
+                        "metadata": {**metadata, "text": text} if CHUNK_TEXT_IN_METADATA else metadata
+                    })
+                for namespace, vectors in by_namespace.items():
+                    for i in range(0, len(vectors), INGEST_UPSERT_BATCH_SIZE):
+                        # Time spent here means upserts are the bottleneck
+                        with span("ingest_wait_upsert"):
+                            upsert_slots.acquire()
+                        batch_num += 1
+                        upsert_pool.submit(upsert, vectors[i:i + INGEST_UPSERT_BATCH_SIZE], namespace, batch_num)
+        finally:
+            stop_event.set()
+            # Unblock the reader if it is waiting on a full queue
+            while reader.is_alive():
+                try:
+                    batch_queue.get_nowait()
+                except queue.Empty:
+                    reader.join(timeout=0.1)
+
+    if upsert_errors:
+        raise upsert_errors[0]
+    return uploaded
+
+
+def ingest(index=None, embedding_model=None, progress=None, downloaded_files=None):
+    """
+    Run one incremental ingestion pass and return a summary.
+
+    `progress`, if given, is called with keyword updates (stage, books_total,
+    current_book, uploaded, ...) so a background job can report status.
+    `downloaded_files` ([{"filename", "path"}]) replaces the Hugging Face
+    download, e.g. for local PDFs or benchmarks.
+    """
+    progress = progress or (lambda **_: None)
+    os.makedirs(HF_CACHE_DIR, exist_ok=True)
+
+    if HF_TOKEN:
+        os.environ['HF_TOKEN'] = HF_TOKEN
+
+    if embedding_model is None:
+        embedding_model = load_embedding_model()
+
+    if index is None:
+        print("🔧 Initializing vector store...")
+        index = open_vector_store(create=True)
+
+    if downloaded_files is None:
+        progress(stage="downloading")
+        downloaded_files, complete = download_books()
+    else:
+        complete = True
+
+    manifest = IngestManifest()
+    try:
+        if complete:
+            prune_removed_files(index, manifest, downloaded_files)
+        # The chunk store can be lost while the manifest survives (separate volumes, a deleted directory);
+        # every book is then re-read so the texts of unchanged chunks come back without re-embedding them
+        restore_texts = bool(manifest.filenames()) and get_chunk_store().stats()["chunks"] == 0
+        if restore_texts:
+            print("♻️ Chunk store is empty, restoring chunk texts for every book")
+        changed_files = select_changed_files(downloaded_files, manifest, everything=restore_texts)
+        print(f"🧾 {len(changed_files)} of {len(downloaded_files)} books need processing")
+        move_namespaces(index, manifest, changed_files)
+        progress(stage="processing", books_total=len(changed_files), uploaded=0)
+
+        if INGEST_WORKERS > 1:
+            print(f"🔄 Processing documents with {INGEST_WORKERS} worker processes...")
+            chunk_iter = iter_chunks_parallel(changed_files, INGEST_WORKERS)
+        else:
+            print("🔄 Processing documents...")
+            text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+            chunk_iter = iter_chunks(changed_files, text_splitter)
+
+        seen = {}
+        pages = {}
+        duplicates = {}
+        started = time.perf_counter()
+        uploaded = run_ingestion(
+            index, embedding_model,
+            filter_changed_chunks(
+                chunk_iter, manifest, seen, pages, progress, duplicates if DEDUP_ENABLED else None, restore_texts
+            ),
+            progress
+        )
+        elapsed = time.perf_counter() - started
+        print(f"⬆️ Uploaded {uploaded} vectors in {elapsed:.1f}s")
+        dropped = sum(len(dropped) for dropped in duplicates.values())
+        if dropped:
+            print(f"🧹 Skipped {dropped} near-duplicate chunks")
+
+        progress(stage="finalizing")
+        update_manifest(index, manifest, changed_files, seen, pages, duplicates)
+        catalog = write_catalog(manifest.book_stats())
+        print(f"📚 Catalog updated with {len(catalog['books'])} books")
+    finally:
+        manifest.close()
+
+    progress(stage="done")
+    return {
+        "books": len(downloaded_files),
+        "changed_books": len(changed_files),
+        "uploaded_vectors": uploaded,
+        "chunks": sum(len(chunks) for chunks in seen.values()) + dropped,
+        "duplicates_dropped": dropped,
+        "seconds": round(elapsed, 1),
+    }
+
+
+def main():
+    if HF_TOKEN:
+        os.environ['HF_TOKEN'] = HF_TOKEN
+
+    embedding_model = load_embedding_model()
+
+    print("🔧 Initializing vector store...")
+    index = open_vector_store(create=True)
+
+    ingest(index, embedding_model)
+
+    final_stats = index.describe_index_stats()
+    print(f"🎉 Complete! Total vectors: {final_stats.total_vector_count}")
+
+    # Test query, scoped to one namespace so it is a single round trip
+    query_embedding = embedding_model.encode("what is array").tolist()
+    results = index.query(
+        vector=query_embedding, top_k=2, include_metadata=True, namespace=next(iter(index.namespaces()), "")
+    )
+    print(f"📊 Test query found {len(results.matches)} results")
+
+
+if __name__ == "__main__":
+    main()
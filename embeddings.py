@@ -0,0 +1,197 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    EMBEDDING_MODEL, EMBEDDING_BACKEND, HF_TOKEN, EMBEDDING_WORKERS, EMBED_BATCH_MAX_SIZE, EMBED_BATCH_WAIT_MS
+)
+
+_model = None
+_model_lock = threading.Lock()
+_executor = None
+
+
+def _load_onnx():
+    import onnx_embedding
+
+    if not os.path.exists(onnx_embedding.model_file()):
+        # One-off export needs torch; run `python onnx_embedding.py export` at build time to keep it off hosts
+        print(f"⚠️ No ONNX export at {onnx_embedding.model_file()}, exporting {EMBEDDING_MODEL} now")
+        onnx_embedding.export()
+    print(f"🤖 Loading ONNX embedding model: {onnx_embedding.model_file()}")
+    return onnx_embedding.OnnxEmbeddingModel()
+
+
+def load_embedding_model():
+    """Load the shared embedding model (SentenceTransformer or ONNX, per EMBEDDING_BACKEND) once per process."""
+    global _model
+
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                if HF_TOKEN:
+                    os.environ['HF_TOKEN'] = HF_TOKEN
+                if EMBEDDING_BACKEND == "onnx":
+                    _model = _load_onnx()
+                elif EMBEDDING_BACKEND == "torch":
+                    from sentence_transformers import SentenceTransformer
+
+                    print(f"🤖 Loading embedding model: {EMBEDDING_MODEL}")
+                    _model = SentenceTransformer(EMBEDDING_MODEL)
+                else:
+                    raise ValueError(f"Unknown EMBEDDING_BACKEND '{EMBEDDING_BACKEND}', expected 'torch' or 'onnx'")
+    return _model
+
+
+def get_executor():
+    """
+    Dedicated pool for CPU-bound encode calls, sized by EMBEDDING_WORKERS so
+    embedding never competes with (or starves) the default executor.
+    """
+    global _executor
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=EMBEDDING_WORKERS, thread_name_prefix="embedding")
+    return _executor
+
+
+class EmbeddingBatcher:
+    """
+    Collects concurrent encode requests for up to `max_wait_ms` (or until
+    `max_batch_size` are queued), runs one batched encode for all of them and
+    resolves each caller's future with its own vector.
+
+    At most EMBEDDING_WORKERS batches are encoded at once; requests arriving
+    meanwhile queue up and form the next batch. The batcher binds to the
+    event loop of its first caller and rebinds if that loop changes.
+    """
+
+    _HISTOGRAM_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+    def __init__(self, max_batch_size=EMBED_BATCH_MAX_SIZE, max_wait_ms=EMBED_BATCH_WAIT_MS, workers=EMBEDDING_WORKERS):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.workers = workers
+        self._loop = None
+        self._queue = None
+        self._task = None
+        self._slots = None
+        self._inflight = set()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._requests = 0
+        self._batches = 0
+        self._batched_items = 0
+        self._largest_batch = 0
+        self._max_queue_depth = 0
+        self._queue_wait_total = 0.0
+        self._encode_time_total = 0.0
+        self._histogram = {bucket: 0 for bucket in self._HISTOGRAM_BUCKETS}
+        self._histogram["+Inf"] = 0
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.workers)
+            self._task = loop.create_task(self._collect())
+
+    async def encode(self, text):
+        self._ensure_running()
+        future = self._loop.create_future()
+        self._queue.put_nowait((text, future, time.perf_counter()))
+        self._requests += 1
+        self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._slots.acquire()
+            task = loop.create_task(self._encode_batch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _encode_batch(self, batch):
+        try:
+            loop = asyncio.get_running_loop()
+            started = time.perf_counter()
+            texts = [text for text, _, _ in batch]
+            model = _model or await loop.run_in_executor(get_executor(), load_embedding_model)
+            embeddings = await loop.run_in_executor(get_executor(), model.encode, texts)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+
+        finished = time.perf_counter()
+        self._record(batch, started, finished)
+        for (_, future, _), embedding in zip(batch, embeddings):
+            # The caller may have been cancelled (e.g. deadline) while we were encoding
+            if not future.done():
+                future.set_result(embedding.tolist())
+
+    def _record(self, batch, started, finished):
+        size = len(batch)
+        self._batches += 1
+        self._batched_items += size
+        self._largest_batch = max(self._largest_batch, size)
+        self._queue_wait_total += sum(started - enqueued for _, _, enqueued in batch)
+        self._encode_time_total += finished - started
+        bucket = next((b for b in self._HISTOGRAM_BUCKETS if size <= b), "+Inf")
+        self._histogram[bucket] += 1
+
+    def stats(self):
+        batches = self._batches or 1
+        items = self._batched_items or 1
+        return {
+            "requests": self._requests,
+            "batches": self._batches,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue_depth": self._max_queue_depth,
+            "avg_batch_size": round(self._batched_items / batches, 2),
+            "max_batch_size": self._largest_batch,
+            "batch_size_histogram": {str(k): v for k, v in self._histogram.items()},
+            "avg_queue_wait_ms": round(1000 * self._queue_wait_total / items, 3),
+            "avg_encode_ms": round(1000 * self._encode_time_total / batches, 3),
+        }
+
+
+batcher = EmbeddingBatcher()
+
+
+async def encode_async(text):
+    """Encode one string off the event loop and return it as a list of floats."""
+    if batcher.max_batch_size > 1:
+        return await batcher.encode(text)
+    loop = asyncio.get_running_loop()
+    model = _model or await loop.run_in_executor(get_executor(), load_embedding_model)
+    embedding = await loop.run_in_executor(get_executor(), model.encode, text)
+    return embedding.tolist()
+
+
+def shutdown():
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
@@ -0,0 +1,129 @@
+import os
+import hashlib
+import sqlite3
+import threading
+import time
+from config import INGEST_MANIFEST_PATH, EMBEDDING_MODEL
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class IngestManifest:
+    """
+    Records what has already been embedded and upserted, so document.py only
+    processes new or changed books and chunks on later runs.
+
+    Entries are scoped to the embedding model and to the vector store namespace
+    a file was written to: switching EMBEDDING_MODEL, or a book's namespace,
+    makes the file look new again.
+    """
+
+    def __init__(self, path=INGEST_MANIFEST_PATH, model_name=EMBEDDING_MODEL):
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                filename TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                model TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                pages INTEGER NOT NULL DEFAULT 0,
+                namespace TEXT NOT NULL DEFAULT ''
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                model TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_by_file ON chunks(filename);
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(files)")]
+        if "pages" not in columns:
+            self._conn.execute("ALTER TABLE files ADD COLUMN pages INTEGER NOT NULL DEFAULT 0")
+        if "namespace" not in columns:
+            # Files recorded before namespaces existed live in the default namespace
+            self._conn.execute("ALTER TABLE files ADD COLUMN namespace TEXT NOT NULL DEFAULT ''")
+
+    def filenames(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT filename FROM files")]
+
+    def file_unchanged(self, filename, sha256, namespace=""):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM files WHERE filename = ? AND sha256 = ? AND model = ? AND namespace = ?",
+                (filename, sha256, self.model_name, namespace)
+            ).fetchone()
+        return row is not None
+
+    def namespace(self, filename):
+        """Namespace the file's vectors were written to, or None if the file isn't recorded."""
+        with self._lock:
+            row = self._conn.execute("SELECT namespace FROM files WHERE filename = ?", (filename,)).fetchone()
+        return row[0] if row else None
+
+    def chunk_hashes(self, filename, namespace=""):
+        """chunk_id -> content hash for chunks embedded with the current model into `namespace`."""
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT c.chunk_id, c.hash FROM chunks c JOIN files f ON f.filename = c.filename
+                WHERE c.filename = ? AND c.model = ? AND f.namespace = ?
+                """,
+                (filename, self.model_name, namespace)
+            ).fetchall()
+        return dict(rows)
+
+    def chunk_ids(self, filename):
+        """All chunk IDs recorded for a file, regardless of model."""
+        with self._lock:
+            rows = self._conn.execute("SELECT chunk_id FROM chunks WHERE filename = ?", (filename,)).fetchall()
+        return [row[0] for row in rows]
+
+    def record_file(self, filename, sha256, chunk_hashes, pages=0, namespace=""):
+        """Replace a file's entry and its full set of chunk hashes in one transaction."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunks WHERE filename = ?", (filename,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (chunk_id, filename, hash, model) VALUES (?, ?, ?, ?)",
+                [(chunk_id, filename, digest, self.model_name) for chunk_id, digest in chunk_hashes.items()]
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (filename, sha256, model, updated_at, pages, namespace) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (filename, sha256, self.model_name, time.time(), pages, namespace)
+            )
+
+    def remove_file(self, filename):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunks WHERE filename = ?", (filename,))
+            self._conn.execute("DELETE FROM files WHERE filename = ?", (filename,))
+
+    def book_stats(self):
+        """Per-book chunk and page counts, in the shape catalog.write_catalog expects."""
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT f.filename, COUNT(c.chunk_id), f.pages, f.updated_at
+                FROM files f LEFT JOIN chunks c ON c.filename = f.filename
+                GROUP BY f.filename
+            """).fetchall()
+        return {
+            filename: {"chunks": chunks, "pages": pages, "updated_at": updated_at}
+            for filename, chunks, pages, updated_at in rows
+        }
+
+    def close(self):
+        self._conn.close()
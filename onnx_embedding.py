@@ -0,0 +1,233 @@
+"""
+ONNX Runtime embedding backend (EMBEDDING_BACKEND=onnx).
+
+    python onnx_embedding.py export   # export + int8 quantize EMBEDDING_MODEL, then run the parity check
+    python onnx_embedding.py parity   # compare ONNX and torch embeddings on sample sentences
+    python onnx_embedding.py bench    # encode latency, throughput, load time and RSS for both backends
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import numpy as np
+from config import EMBEDDING_MODEL, ONNX_MODEL_DIR, ONNX_QUANTIZE, ONNX_THREADS, EMBEDDING_PARITY_THRESHOLD
+
+_CONFIG_FILE = "embedding_config.json"
+_PARITY_SENTENCES = [
+    "what is array",
+    "Explain the difference between a stack and a queue.",
+    "How does photosynthesis convert light energy into chemical energy?",
+    "Who wrote the constitution and when was it adopted?",
+    "A linked list stores elements in nodes that point to the next node.",
+    "Newton's second law relates force, mass and acceleration.",
+    "The mitochondria is the powerhouse of the cell.",
+    "Sorting algorithms such as merge sort run in O(n log n) time.",
+    "book",
+    "",
+]
+
+
+def model_file(model_dir=ONNX_MODEL_DIR, quantized=ONNX_QUANTIZE):
+    return os.path.join(model_dir, "model.int8.onnx" if quantized else "model.onnx")
+
+
+class OnnxEmbeddingModel:
+    """
+    Drop-in for the SentenceTransformer.encode() calls this repo makes:
+    tokenizes with the exported fast tokenizer, runs the transformer through
+    ONNX Runtime and applies the model's pooling and normalisation in numpy.
+    Texts are sorted by length before batching so padding stays small.
+    """
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, quantized=ONNX_QUANTIZE, threads=ONNX_THREADS):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, _CONFIG_FILE)) as f:
+            self.config = json.load(f)
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            model_file(model_dir, quantized), options, providers=["CPUExecutionProvider"]
+        )
+        self._inputs = [i.name for i in self.session.get_inputs()]
+
+    def _encode_batch(self, texts):
+        encoded = self.tokenizer.encode_batch(texts)
+        features = {
+            "input_ids": np.array([e.ids for e in encoded], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encoded], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encoded], dtype=np.int64),
+        }
+        hidden = self.session.run(None, {name: features[name] for name in self._inputs})[0]
+        if self.config["pooling"] == "cls":
+            pooled = hidden[:, 0]
+        else:
+            mask = features["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.config["normalize"]:
+            pooled = pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return pooled.astype(np.float32)
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.config["dimension"]), dtype=np.float32)
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        embeddings = np.empty((len(texts), self.config["dimension"]), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            embeddings[rows] = self._encode_batch([texts[i] for i in rows])
+        return embeddings[0] if single else embeddings
+
+
+def export(model_name=EMBEDDING_MODEL, model_dir=ONNX_MODEL_DIR, quantize=ONNX_QUANTIZE):
+    """Export a SentenceTransformer's transformer to ONNX (plus an int8 dynamic-quantized copy). Needs torch."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(model_dir, exist_ok=True)
+    print(f"📦 Exporting {model_name} to ONNX in {model_dir}")
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model.tokenizer
+
+    sample = tokenizer(["export sample sentence", "another one"], padding=True, return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs))).last_hidden_state
+
+    axes = {0: "batch", 1: "sequence"}
+    torch.onnx.export(
+        LastHiddenState(transformer),
+        tuple(sample[name] for name in input_names),
+        model_file(model_dir, quantized=False),
+        input_names=input_names,
+        output_names=["last_hidden_state"],
+        dynamic_axes={**{name: axes for name in input_names}, "last_hidden_state": axes},
+        opset_version=14,
+    )
+    tokenizer.save_pretrained(model_dir)
+
+    pooling = st_model[1] if len(st_model) > 1 else None
+    with open(os.path.join(model_dir, _CONFIG_FILE), "w") as f:
+        json.dump({
+            "model": model_name,
+            "dimension": st_model.get_sentence_embedding_dimension(),
+            "max_seq_length": st_model.max_seq_length,
+            "pooling": "cls" if getattr(pooling, "pooling_mode_cls_token", False) else "mean",
+            "normalize": any(type(module).__name__ == "Normalize" for module in st_model),
+            "pad_token": tokenizer.pad_token,
+            "pad_token_id": tokenizer.pad_token_id,
+        }, f, indent=2)
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        print("🗜️ Quantizing weights to int8...")
+        quantize_dynamic(model_file(model_dir, quantized=False), model_file(model_dir, quantized=True),
+                         weight_type=QuantType.QInt8)
+    print(f"✅ Exported {model_file(model_dir, quantize)}")
+
+
+def parity(onnx_model, torch_model, sentences=_PARITY_SENTENCES, threshold=EMBEDDING_PARITY_THRESHOLD):
+    """Cosine agreement between backends per sentence; raises ValueError if any falls below `threshold`."""
+    a = np.asarray(onnx_model.encode(sentences), dtype=np.float32)
+    b = np.asarray(torch_model.encode(sentences, convert_to_numpy=True), dtype=np.float32)
+    cosine = (a * b).sum(axis=1) / np.maximum(np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1), 1e-12)
+    report = {"min_cosine": round(float(cosine.min()), 5), "mean_cosine": round(float(cosine.mean()), 5),
+              "threshold": threshold, "sentences": len(sentences)}
+    if cosine.min() < threshold:
+        worst = sentences[int(cosine.argmin())]
+        raise ValueError(f"ONNX embeddings disagree with torch (min cosine {cosine.min():.4f} on {worst!r}): {report}")
+    return report
+
+
+def _rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _bench_backend(backend, runs, batch_size):
+    """Measured in a fresh interpreter so import time and RSS belong to one backend only."""
+    started = time.perf_counter()
+    if backend == "onnx":
+        model = OnnxEmbeddingModel()
+    else:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+    load_seconds = time.perf_counter() - started
+    model.encode(["warm up"])
+
+    single = []
+    for i in range(runs):
+        started = time.perf_counter()
+        model.encode(_PARITY_SENTENCES[i % (len(_PARITY_SENTENCES) - 1)])
+        single.append(time.perf_counter() - started)
+
+    corpus = [" ".join(_PARITY_SENTENCES[:8])[:(i % 8 + 1) * 120] for i in range(batch_size * 8)]
+    started = time.perf_counter()
+    model.encode(corpus, batch_size=batch_size)
+    batch_seconds = time.perf_counter() - started
+
+    single_ms = np.asarray(single) * 1000
+    return {
+        "backend": backend,
+        "load_seconds": round(load_seconds, 3),
+        "single_p50_ms": round(float(np.percentile(single_ms, 50)), 3),
+        "single_p95_ms": round(float(np.percentile(single_ms, 95)), 3),
+        "batch_throughput_per_sec": round(len(corpus) / batch_seconds, 1),
+        "peak_rss_mb": round(_rss_mb(), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ONNX embedding backend tools")
+    parser.add_argument("command", choices=["export", "parity", "bench", "bench-one"])
+    parser.add_argument("--backend", choices=["torch", "onnx"], help=argparse.SUPPRESS)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--output", help="write the bench results to this JSON file")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export()
+    if args.command in ("export", "parity"):
+        from sentence_transformers import SentenceTransformer
+        report = parity(OnnxEmbeddingModel(), SentenceTransformer(EMBEDDING_MODEL, device="cpu"))
+        print(f"✅ Parity check passed: {report}")
+    elif args.command == "bench-one":
+        print(json.dumps(_bench_backend(args.backend, args.runs, args.batch_size)))
+    elif args.command == "bench":
+        results = []
+        for backend in ("torch", "onnx"):
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "bench-one", "--backend", backend,
+                 "--runs", str(args.runs), "--batch-size", str(args.batch_size)],
+                capture_output=True, text=True, check=True
+            ).stdout
+            results.append(json.loads(out.strip().splitlines()[-1]))
+            print(f"⏱️ {results[-1]}")
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({"model": EMBEDDING_MODEL, "quantized": ONNX_QUANTIZE, "results": results}, f, indent=2)
+            print(f"💾 Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
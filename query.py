@@ -1,90 +1,33 @@
-import os
-import subprocess
-import sys
-from pinecone import Pinecone
-from sentence_transformers import SentenceTransformer
-from cerebras.cloud.sdk import Cerebras
-from config import PINECONE_API_KEY, PINECONE_INDEX_NAME, EMBEDDING_MODEL, HF_TOKEN, CEREBRAS_API_KEY
+import asyncio
 import json
-pc = None
+import time
+import math
+import random
+import httpx
+import numpy as np
+from cerebras.cloud.sdk import AsyncCerebras
+from config import (
+    CEREBRAS_API_KEY, INDEX_READY_TTL, INDEX_RETRY_TTL,
+    LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE, LLM_TIMEOUT, LLM_MODEL,
+    PINECONE_DIMENSION, QUIZ_BANK_BATCH_SIZE, QUIZ_BANK_CONTEXT_CHUNKS, QUIZ_SHARD_SIZE, QUIZ_SHARD_RETRIES,
+    HISTORY_SUMMARY_TOKENS
+)
+from vector_store import open_vector_store, book_scope
+from catalog import book_catalog
+from chunk_store import get_chunk_store, lookup_texts, lookup_duplicate_pages
+from context_packing import pack_contexts
+from readiness import IndexReadiness, IngestionJob, IndexNotReady
+from embeddings import load_embedding_model, encode_async
+from answer_cache import answer_cache
+from context_budget import history_compactor, message_tokens
+from quiz_bank import QuizBank, QuizBankFiller, validate_question, question_hash
+from admission import stages
+from telemetry import span, record, log_prompt
 index = None
 embedding_model = None
+llm_client = None
 
-def initialize_pinecone():
-    global pc, index, embedding_model
-    
-    if pc is None:
-        pc = Pinecone(api_key=PINECONE_API_KEY)
-        index = pc.Index(PINECONE_INDEX_NAME)
-        print(f"🔗 Connected to Pinecone index: {PINECONE_INDEX_NAME}")
-    
-    if embedding_model is None:
-        if HF_TOKEN:
-            os.environ['HF_TOKEN'] = HF_TOKEN
-        embedding_model = SentenceTransformer(EMBEDDING_MODEL)
-
-def get_existing_collection():
-    global pc, index, embedding_model
-    
-    try:
-        initialize_pinecone()
-        stats = index.describe_index_stats()
-        if stats.total_vector_count > 0:
-            print(f"✅ Connected to existing index with {stats.total_vector_count} documents")
-            return True
-        else:
-            return False
-    except Exception as e:
-        print(f"❌ Index not found, running document processing...")
-        try:
-            result = subprocess.run([sys.executable, "document.py"], timeout=600)
-            if result.returncode == 0:
-                initialize_pinecone()
-                return True
-        except Exception:
-            pass
-        return False
-
-def get_available_books():
-    global pc, index, embedding_model
-    
-    if not get_existing_collection():
-        return []
-    
-    try:
-        sample_query = embedding_model.encode("book").tolist()
-        results = index.query(vector=sample_query, top_k=1000, include_metadata=True)
-        
-        books = set()
-        for match in results.matches:
-            if 'book' in match.metadata:
-                books.add(match.metadata['book'])
-        return list(books)
-    except Exception:
-        return []
-
-def quizz_collection(book=None, n_results=3,question=10):
-    
-    global pc, index, embedding_model
-    
-    if not get_existing_collection():
-        raise Exception("No data available in Pinecone index")
-    
-    query_embedding = embedding_model.encode("topics topic").tolist()
-    
-    query_params = {"vector": query_embedding, "top_k": n_results, "include_metadata": True}
-    if book:
-        query_params["filter"] = {"book": book}
-        print(f"🔍 Searching in book: {book}")
-    
-    results = index.query(**query_params)
-    print(f"📊 Found {len(results.matches)} relevant chunks")
-    
-    contexts = [match.metadata['text'] for match in results.matches if 'text' in match.metadata]
-    context = "\n\n".join(contexts)
-    
-    client = Cerebras(api_key=CEREBRAS_API_KEY)
-    question_schema = {
+question_schema = {
     "type": "object",
     "properties": {
         "questions": {
@@ -105,17 +48,178 @@ def quizz_collection(book=None, n_results=3,question=10):
     },
     "additionalProperties": False
 }
+
+def initialize_vector_store():
+    global index, embedding_model
+    
+    if index is None:
+        index = open_vector_store()
+    
+    if embedding_model is None:
+        embedding_model = load_embedding_model()
+
+def get_llm_client():
+    """One long-lived async Cerebras client whose HTTP pool is shared by every request."""
+    global llm_client
+    
+    if llm_client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_KEEPALIVE),
+            timeout=LLM_TIMEOUT
+        )
+        # The SDK's own warm-up is a blocking request on a throwaway sync client; warm_llm_client() warms this pool
+        llm_client = AsyncCerebras(api_key=CEREBRAS_API_KEY, http_client=http_client, warm_tcp_connection=False)
+    return llm_client
+
+async def warm_llm_client():
+    """Open a connection in the shared pool at startup so the first request skips the TCP/TLS handshake."""
+    try:
+        await get_llm_client().get("/v1/tcp_warming", cast_to=str, options={"timeout": 1, "max_retries": 0})
+    except Exception as e:
+        print(f"⚠️ LLM connection warm-up failed: {e}")
+
+async def close_clients():
+    global llm_client
+    
+    if llm_client is not None:
+        await llm_client.close()
+        llm_client = None
+
+def _count_vectors():
+    initialize_vector_store()
+    count = index.describe_index_stats().total_vector_count
+    if count and not _chunk_texts_available():
+        # Answering now would prompt the LLM with empty context
+        raise RuntimeError(
+            f"index has {count} vectors but their chunk texts are missing on this host "
+            "(empty chunk store and no text in vector metadata); re-run ingestion"
+        )
+    return count
+
+def _chunk_texts_available():
+    """True if retrieved chunks will have text: the local chunk store has rows or the vectors carry metadata text."""
+    if get_chunk_store().stats()["chunks"]:
+        return True
+    sample = index.query(
+        vector=[0.0] * (PINECONE_DIMENSION - 1) + [1.0], top_k=1, include_metadata=True,
+        namespace=next(iter(index.namespaces()), "")
+    )
+    return any(match.metadata and match.metadata.get("text") for match in sample.matches)
+
+def _run_ingestion(progress):
+    import document
+    
+    summary = document.ingest(embedding_model=load_embedding_model(), progress=progress)
+    book_catalog.invalidate()
+    return summary
+
+ingestion_job = IngestionJob(_run_ingestion)
+readiness = IndexReadiness(_count_vectors, ingestion_job, ttl=INDEX_READY_TTL, retry_ttl=INDEX_RETRY_TTL)
+
+async def get_existing_collection():
+    """Check the cached readiness state; raises IndexNotReady instead of probing or ingesting in the request."""
+    loop = asyncio.get_running_loop()
+    try:
+        if index is None or embedding_model is None:
+            await loop.run_in_executor(None, initialize_vector_store)
+    except Exception as e:
+        raise IndexNotReady(f"Vector store unavailable: {e}")
+    if readiness.expired():
+        await loop.run_in_executor(None, readiness.check)
+    readiness.ensure_ready()
+    return True
+
+def start_ingestion():
+    return ingestion_job.start()
+
+async def embed(text):
+    with span("embed"):
+        async with stages["embedding"].slot():
+            return await encode_async(text)
+
+async def search(**kwargs):
+    """Vector query; with `namespaces`, one concurrent round trip across them, merged by score."""
+    with span("retrieve"):
+        async with stages["retrieval"].slot():
+            return await index.aquery_namespaces(**kwargs)
+
+async def complete(stage="llm", **kwargs):
+    """Non-streaming chat completion, counted against the LLM concurrency limit and timed as `stage`."""
+    with span(stage):
+        async with stages["llm"].slot():
+            return await get_llm_client().chat.completions.create(**kwargs)
+
+def book_list(book):
+    """Normalise a book selection (None, a name or a list of names) to a sorted tuple, or None for every book."""
+    if not book:
+        return None
+    names = [book] if isinstance(book, str) else book
+    return tuple(sorted({name for name in names if name})) or None
+
+async def retrieve(query, book=None, n_results=3, query_embedding=None):
+    if query_embedding is None:
+        query_embedding = await embed(query)
+    
+    books = book_list(book)
+    if books:
+        print(f"🔍 Searching in book{'s' if len(books) > 1 else ''}: {', '.join(books)}")
+    namespaces, query_filter = book_scope(books)
+    
+    results = await search(
+        vector=query_embedding, namespaces=namespaces, top_k=n_results, filter=query_filter, include_metadata=True
+    )
+    print(f"📊 Found {len(results.matches)} relevant chunks")
+    return results
+
+async def get_available_books():
+    with span("available_books"):
+        books = book_catalog.books()
+        if books:
+            return books
+        return await _scan_available_books()
+
+async def _scan_available_books():
+    # No catalog on this host yet (index ingested elsewhere): scan the index once and keep the result in memory
+    try:
+        await get_existing_collection()
+    except IndexNotReady:
+        return []
+    
+    try:
+        # Each book's namespace is named after it, so the index stats list every book
+        namespaces = await asyncio.get_running_loop().run_in_executor(None, index.namespaces)
+        books = {namespace for namespace in namespaces if namespace}
+        if "" in namespaces:
+            # Flat layout: only the books among a sample of default-namespace chunks are found
+            sample_query = await embed("book")
+            results = await search(vector=sample_query, namespaces=[""], top_k=1000, include_metadata=True)
+            for match in results.matches:
+                if 'book' in match.metadata:
+                    books.add(match.metadata['book'])
+        book_catalog.seed(books)
+        return sorted(books)
+    except Exception:
+        return []
+
+def join_contexts(results):
+    with span("context_pack"):
+        context, _ = pack_contexts(results.matches, lookup_texts(results.matches))
+    return context
+
+async def generate_quiz_questions(context, question=10):
+    """One structured-output completion over `context`; returns the list of raw question dicts."""
     system_prompt = """You are a helpful assistant for educational books. give me ${question} quizz questions. you generate a quizz question with 4 options and also provide the correct answer. Always cite which book the information comes from when possible and also don't include based on context liked."""
 
     user_prompt = f"""
 topics from books: {context}
 Please provide a helpful quiz question with 4 options and the correct answer based on the topic above, create {question} questions based on the topic and also don't include any personal opinions or information not contained in the context and also don't include based on context liked"""
-    chat_completion = client.chat.completions.create(
+    chat_completion = await complete(
+        "llm_quiz",
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ],
-        model="llama-4-scout-17b-16e-instruct",
+        model=LLM_MODEL,
         response_format={
         "type": "json_schema", 
         "json_schema": {
@@ -125,65 +229,297 @@ Please provide a helpful quiz question with 4 options and the correct answer bas
         }
     }
     )
-   
+    payload = json.loads(chat_completion.choices[0].message.content)
+    check_question_schema(payload)
+    return payload["questions"]
 
-    return {
-        "message": json.loads(chat_completion.choices[0].message.content),
-        "available_books": get_available_books(),
-        "query_book_filter": book
-    }
-def query_collection(query, message=None, book=None, n_results=3):
+def check_question_schema(payload):
+    """Raise ValueError unless payload has the shape question_schema describes."""
+    if not isinstance(payload, dict) or not isinstance(payload.get("questions"), list):
+        raise ValueError("quiz payload has no 'questions' array")
+    for item in payload["questions"]:
+        if not isinstance(item, dict):
+            raise ValueError("quiz question is not an object")
+        for field in ("question", "topic", "answer"):
+            if field in item and not isinstance(item[field], str):
+                raise ValueError(f"quiz question field '{field}' is not a string")
+        options = item.get("options", [])
+        if not isinstance(options, list) or not all(isinstance(option, str) for option in options):
+            raise ValueError("quiz question 'options' is not an array of strings")
+
+async def generate_quiz_sharded(book, n_results, question):
+    """
+    Generate a large quiz as ceil(question / QUIZ_SHARD_SIZE) concurrent
+    completions, each over its own slice of the retrieved chunks.
+
+    A shard whose output is truncated, off-schema or has no usable question
+    is retried on its own (up to QUIZ_SHARD_RETRIES times); the others are
+    kept. Results are merged in shard order with duplicate questions removed,
+    and a shortfall from failed shards or duplicates is re-requested once over
+    the whole context. The result can still be short; callers compare its
+    length with `question`.
+    """
+    shard_count = math.ceil(question / QUIZ_SHARD_SIZE)
+    sizes = [QUIZ_SHARD_SIZE] * (question // QUIZ_SHARD_SIZE)
+    if question % QUIZ_SHARD_SIZE:
+        sizes.append(question % QUIZ_SHARD_SIZE)
     
-    global pc, index, embedding_model
+    results = await retrieve("topics topic", book, n_results * shard_count)
+    # Deal chunks round-robin so every shard gets a mix of high- and low-ranked context
+    shard_contexts = [
+        pack_contexts(results.matches[i::shard_count], lookup_texts(results.matches[i::shard_count]))[0]
+        for i in range(shard_count)
+    ]
     
-    if not get_existing_collection():
-        raise Exception("No data available in Pinecone index")
+    async def run_shard(i):
+        for attempt in range(QUIZ_SHARD_RETRIES + 1):
+            try:
+                questions = await generate_quiz_questions(shard_contexts[i], sizes[i])
+                if any(validate_question(q) for q in questions):
+                    return questions
+                raise ValueError("no valid questions")
+            except Exception as e:
+                print(f"⚠️ Quiz shard {i + 1}/{shard_count} attempt {attempt + 1} failed: {e}")
+        return None
     
-    query_embedding = embedding_model.encode(query).tolist()
+    shard_results = await asyncio.gather(*(run_shard(i) for i in range(shard_count)))
+    if all(result is None for result in shard_results):
+        raise Exception("All quiz shards failed")
     
-    query_params = {"vector": query_embedding, "top_k": n_results, "include_metadata": True}
-    if book:
-        query_params["filter"] = {"book": book}
-        print(f"🔍 Searching in book: {book}")
+    merged = []
+    seen = set()
     
-    results = index.query(**query_params)
-    print(f"📊 Found {len(results.matches)} relevant chunks")
+    def merge(questions):
+        for item in questions or []:
+            cleaned = validate_question(item)
+            if cleaned is None:
+                continue
+            digest = question_hash(cleaned["question"])
+            if digest not in seen and len(merged) < question:
+                seen.add(digest)
+                merged.append(cleaned)
     
-    contexts = [match.metadata['text'] for match in results.matches if 'text' in match.metadata]
-    context = "\n\n".join(contexts)
+    for questions in shard_results:
+        merge(questions)
     
-    client = Cerebras(api_key=CEREBRAS_API_KEY)
+    shortfall = question - len(merged)
+    if shortfall:
+        # One top-up shard over every retrieved chunk, capped like any other shard
+        context = pack_contexts(results.matches, lookup_texts(results.matches))[0]
+        try:
+            merge(await generate_quiz_questions(context, min(shortfall, QUIZ_SHARD_SIZE)))
+        except Exception as e:
+            print(f"⚠️ Quiz top-up for {shortfall} missing questions failed: {e}")
+    print(f"🧩 Generated {len(merged)} of {question} questions across {shard_count} shards")
+    return merged
+
+def _random_direction():
+    vector = np.random.normal(size=PINECONE_DIMENSION)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+async def _generate_for_bank(book, topics):
+    await get_existing_collection()
+    
+    # Alternate between deepening topic clusters the bank already has and probing a random
+    # direction in embedding space, so successive refills are built from different chunks
+    if topics and random.random() < 0.5:
+        results = await retrieve(random.choice(topics), book, QUIZ_BANK_CONTEXT_CHUNKS)
+    else:
+        results = await retrieve("random topic", book, QUIZ_BANK_CONTEXT_CHUNKS, _random_direction())
+    return await generate_quiz_questions(join_contexts(results), QUIZ_BANK_BATCH_SIZE)
+
+quiz_bank = QuizBank()
+quiz_filler = QuizBankFiller(quiz_bank, _generate_for_bank, get_available_books)
+
+async def quizz_collection(book=None, n_results=3,question=10):
+    """Serve questions from the pre-generated bank, generating live only what the bank can't cover."""
+    
+    question = int(question)
+    books = book_list(book)
+    banked_ids, banked = [], []
+    if quiz_filler.enabled:
+        with span("quiz_bank"):
+            banked_ids, banked = quiz_bank.sample(books, question)
+        if len(banked) < question:
+            for name in books or [None]:
+                quiz_filler.request_refill(name)
+    
+    if len(banked) >= question:
+        response = {
+            "message": {"questions": banked},
+            "available_books": await get_available_books(),
+            "query_book_filter": book,
+            "source": "bank",
+            "partial": False
+        }
+        # Only a response that was built uses up the questions' serves
+        quiz_bank.mark_served(banked_ids)
+        return response
+    
+    await get_existing_collection()
+    
+    remaining = question - len(banked)
+    with span("quiz_generate"):
+        if remaining > QUIZ_SHARD_SIZE:
+            live = await generate_quiz_sharded(books, n_results, remaining)
+        else:
+            results = await retrieve("topics topic", books, n_results)
+            live = await generate_quiz_questions(join_contexts(results), remaining)
+    response = {
+        "message": {"questions": banked + live},
+        "available_books": await get_available_books(),
+        "query_book_filter": book,
+        "source": "mixed" if banked else "live",
+        # Fewer questions than asked for, e.g. after failed shards or duplicates
+        "partial": len(banked) + len(live) < question
+    }
+    if quiz_filler.enabled:
+        with span("quiz_bank"):
+            quiz_bank.mark_served(banked_ids)
+            if books and len(books) == 1:
+                # Already served once, but still useful to later requests
+                quiz_bank.add(books[0], live, served=1)
+    return response
+
+async def summarize_history(previous_summary, turns):
+    """Fold older conversation turns (and any earlier summary) into a short rolling summary."""
+    transcript = "\n".join(f"{turn.get('role', 'user')}: {turn.get('content', '')}" for turn in turns)
+    if previous_summary:
+        transcript = f"Earlier summary: {previous_summary}\n{transcript}"
+    chat_completion = await complete(
+        "llm_summary",
+        messages=[
+            {"role": "system", "content": "Summarize this tutoring conversation in a few sentences. Keep the topics, books and facts the student asked about and any answers they were given."},
+            {"role": "user", "content": transcript}
+        ],
+        model=LLM_MODEL,
+        max_completion_tokens=HISTORY_SUMMARY_TOKENS,
+    )
+    return chat_completion.choices[0].message.content.strip()
 
+async def prepare_query(query, message=None, book=None, n_results=3, query_embedding=None, conversation_id=None):
+    """
+    Retrieve context and build the chat messages and source list shared by the blocking and streaming paths.
+    Conversation history is compacted to fit PROMPT_TOKEN_BUDGET; returns (messages, sources, prompt_info).
+    """
+    await get_existing_collection()
+    
+    results = await retrieve(query, book, n_results, query_embedding)
+    with span("context_pack"):
+        context, context_info = pack_contexts(results.matches, lookup_texts(results.matches))
+    
     system_prompt = """You are a helpful assistant for educational books. Use the provided context to answer accurately. Always cite which book the information comes from when possible and also don't include based on context liked."""
 
     user_prompt = f"""Question: {query}
 Context from books: {context}
 Please provide a helpful answer based on the context above and also don't include any personal opinions or information not contained in the context and also don't include based on context liked"""
-    if(message):
-        message=[  {"role": "system", "content": system_prompt}]+message+[{"role": "user", "content": user_prompt}]
-    # chat_completion = client.chat.completions.create(
-    #     messages=[
-    #         {"role": "system", "content": system_prompt},
-    #         {"role": "user", "content": user_prompt}
-    #     ],
-    #     model="llama-4-scout-17b-16e-instruct",
-    # )
-    print("messages to send to backend: "+str(message))
-    chat_completion = client.chat.completions.create(
-        messages=message,
-        model="llama-4-scout-17b-16e-instruct",
-    )
+    system_message = {"role": "system", "content": system_prompt}
+    user_message = {"role": "user", "content": user_prompt}
+    fixed_tokens = message_tokens(system_message) + message_tokens(user_message)
+    with span("history_compact"):
+        history, prompt_info = await history_compactor.compact(message, fixed_tokens, conversation_id, summarize_history)
+    messages = [system_message] + history + [user_message]
+    prompt_info["prompt_tokens"] = fixed_tokens + sum(message_tokens(m) for m in history)
+    prompt_info["context"] = context_info
+    log_prompt(messages)
     
+    # Pages where the same passage was dropped as a near-duplicate at ingestion
+    duplicate_pages = lookup_duplicate_pages(results.matches)
     sources_info = [{
         "id": match.id,
         "book": match.metadata.get('book', 'unknown'),
         "page": match.metadata.get('page_number', 'unknown'),
+        "also_on_pages": duplicate_pages.get(match.id, []),
         "score": match.score
     } for match in results.matches]
+    return messages, sources_info, prompt_info
+
+async def query_collection(query, message=None, book=None, n_results=3, conversation_id=None):
+    """
+    Answer a question from the books. `book` is one book, a list of books
+    searched together, or None for every book. The result's "cache" field is
+    "exact", "semantic", "miss", or "bypass" (conversation history present).
+    """
     
-    return {
+    use_cache = answer_cache.enabled and not message
+    index_version = book_catalog.version
+    books = book_list(book)
+    
+    if use_cache:
+        with span("answer_cache"):
+            cached = answer_cache.get_exact(query, books, n_results, index_version)
+        if cached is not None:
+            return {**cached, "available_books": await get_available_books(), "cache": "exact"}
+    
+    await get_existing_collection()
+    query_embedding = await embed(query)
+    
+    if use_cache:
+        with span("answer_cache"):
+            cached = answer_cache.get_semantic(query_embedding, books, n_results, index_version)
+        if cached is not None:
+            return {**cached, "available_books": await get_available_books(), "cache": "semantic"}
+    
+    messages, sources_info, prompt_info = await prepare_query(
+        query, message, book, n_results, query_embedding, conversation_id
+    )
+    
+    chat_completion = await complete(
+        messages=messages,
+        model=LLM_MODEL,
+    )
+    
+    answer = {
         "message": chat_completion.choices[0].message.content,
         "sources": sources_info,
-        "available_books": get_available_books(),
-        "query_book_filter": book
-    }
\ No newline at end of file
+        "query_book_filter": book,
+        # Cached with the answer so hits return the same fields as misses
+        "prompt": prompt_info
+    }
+    if use_cache:
+        answer_cache.put(query, query_embedding, books, n_results, index_version, answer)
+    
+    return {
+        **answer,
+        "available_books": await get_available_books(),
+        "cache": "miss" if use_cache else "bypass"
+    }
+
+async def stream_query_collection(query, message=None, book=None, n_results=3, conversation_id=None):
+    """
+    Async generator of (event, data) pairs: one "sources" event as soon as
+    retrieval finishes, a "token" event per completion delta, then "done".
+
+    Closing the generator (client disconnect) closes the upstream completion
+    stream, so abandoned answers stop consuming LLM capacity.
+    """
+    messages, sources_info, prompt_info = await prepare_query(
+        query, message, book, n_results, conversation_id=conversation_id
+    )
+    yield "sources", {
+        "sources": sources_info,
+        "available_books": await get_available_books(),
+        "query_book_filter": book,
+        "prompt": prompt_info
+    }
+    
+    # The LLM slot is held for the whole stream, not just until the first token
+    async with stages["llm"].slot():
+        started = time.perf_counter()
+        first_token = True
+        stream = await get_llm_client().chat.completions.create(
+            messages=messages,
+            model=LLM_MODEL,
+            stream=True,
+        )
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if first_token:
+                        record("llm_first_token", time.perf_counter() - started)
+                        first_token = False
+                    yield "token", {"content": chunk.choices[0].delta.content}
+        finally:
+            record("llm_stream", time.perf_counter() - started)
+            await stream.close()
+    yield "done", {}
@@ -0,0 +1,248 @@
+import os
+import json
+import random
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+import logging
+from config import (
+    QUIZ_BANK_PATH, QUIZ_BANK_LOW_WATERMARK, QUIZ_BANK_HIGH_WATERMARK,
+    QUIZ_BANK_MAX_SERVES, QUIZ_BANK_REFILL_INTERVAL, QUIZ_BANK_WORKERS
+)
+
+logger = logging.getLogger(__name__)
+
+
+def validate_question(item):
+    """Return a cleaned question dict, or None if it isn't a usable 4-option question with a matching answer."""
+    if not isinstance(item, dict):
+        return None
+    question = item.get("question")
+    options = item.get("options")
+    answer = item.get("answer")
+    if not isinstance(question, str) or not question.strip():
+        return None
+    if not isinstance(options, list) or len(options) != 4:
+        return None
+    options = [str(option).strip() for option in options]
+    if not all(options) or len({option.lower() for option in options}) != 4:
+        return None
+    if not isinstance(answer, str) or not answer.strip():
+        return None
+    answer = answer.strip()
+    # Accept "B" / "B)" style answers by mapping them onto the option text
+    letter = answer.rstrip(").:").upper()
+    if letter in ("A", "B", "C", "D"):
+        answer = options["ABCD".index(letter)]
+    if answer.lower() not in {option.lower() for option in options}:
+        return None
+    return {
+        "question": question.strip(),
+        "topic": str(item.get("topic") or "general").strip(),
+        "answer": answer,
+        "options": options,
+    }
+
+
+def _book_clause(book):
+    """SQL condition and params restricting to one book or a list of books; no condition for None."""
+    if not book:
+        return "", []
+    books = [book] if isinstance(book, str) else list(book)
+    return f" AND book IN ({','.join('?' * len(books))})", books
+
+
+def question_hash(question):
+    normalized = " ".join(question.lower().split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+class QuizBank:
+    """
+    Local store of pre-generated, validated quiz questions per book.
+
+    A question is served at most `max_serves` times; the number of questions
+    still servable is what the refill watermarks are measured against.
+    """
+
+    def __init__(self, path=QUIZ_BANK_PATH, max_serves=QUIZ_BANK_MAX_SERVES):
+        self.max_serves = max_serves
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS questions (
+                id INTEGER PRIMARY KEY,
+                book TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                question TEXT NOT NULL,
+                options TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                qhash TEXT NOT NULL,
+                served INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                UNIQUE (book, qhash)
+            );
+            CREATE INDEX IF NOT EXISTS questions_by_book ON questions(book, served);
+        """)
+
+    def add(self, book, questions, served=0):
+        """Validate and insert questions, skipping duplicates; returns how many were stored."""
+        rows = []
+        for item in questions:
+            cleaned = validate_question(item)
+            if cleaned is None:
+                continue
+            rows.append((
+                book, cleaned["topic"], cleaned["question"], json.dumps(cleaned["options"]),
+                cleaned["answer"], question_hash(cleaned["question"]), served, time.time()
+            ))
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany("""
+                INSERT OR IGNORE INTO questions (book, topic, question, options, answer, qhash, served, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            return self._conn.total_changes - before
+
+    def available(self, book=None):
+        clause, books = _book_clause(book)
+        query = "SELECT COUNT(*) FROM questions WHERE served < ?" + clause
+        params = [self.max_serves] + books
+        with self._lock:
+            return self._conn.execute(query, params).fetchone()[0]
+
+    def topics(self, book):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT DISTINCT topic FROM questions WHERE book = ?", (book,))]
+
+    def sample(self, book, count):
+        """
+        Pick up to `count` servable questions, spread round-robin across topic
+        clusters so one topic doesn't dominate a quiz. `book` is one book, a
+        list of books, or None for any book. Returns (ids, questions); pass the
+        ids to mark_served() once the questions have actually been served.
+        """
+        clause, books = _book_clause(book)
+        query = "SELECT id, topic, question, options, answer FROM questions WHERE served < ?" + clause
+        params = [self.max_serves] + books
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+            by_topic = {}
+            for row in rows:
+                by_topic.setdefault(row[1], []).append(row)
+            for topic_rows in by_topic.values():
+                random.shuffle(topic_rows)
+            clusters = list(by_topic.values())
+            random.shuffle(clusters)
+
+            picked = []
+            while len(picked) < count and clusters:
+                for cluster in list(clusters):
+                    if len(picked) >= count:
+                        break
+                    picked.append(cluster.pop())
+                    if not cluster:
+                        clusters.remove(cluster)
+
+        return [row[0] for row in picked], [
+            {"question": question, "topic": topic, "answer": answer, "options": json.loads(options)}
+            for _, topic, question, options, answer in picked
+        ]
+
+    def mark_served(self, ids):
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE questions SET served = served + 1 WHERE id = ?", [(i,) for i in ids])
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT book, COUNT(*), SUM(served < ?) FROM questions GROUP BY book", (self.max_serves,)
+            ).fetchall()
+        return {book: {"total": total, "available": available or 0} for book, total, available in rows}
+
+
+class QuizBankFiller:
+    """
+    Background task that keeps every book's pool between the low and high
+    watermarks. It wakes every `interval` seconds or as soon as a request
+    finds a pool short, and runs at most `workers` generations at once.
+
+    `generate(book, topics)` must return a list of raw question dicts and
+    `books()` the list of book names; both are coroutines.
+    """
+
+    # Generations per book per cycle, so a book whose output keeps failing validation can't spin forever
+    _MAX_ATTEMPTS = 10
+
+    def __init__(self, bank, generate, books, low=QUIZ_BANK_LOW_WATERMARK, high=QUIZ_BANK_HIGH_WATERMARK,
+                 interval=QUIZ_BANK_REFILL_INTERVAL, workers=QUIZ_BANK_WORKERS):
+        self.bank = bank
+        self._generate = generate
+        self._books = books
+        self.low = low
+        self.high = high
+        self.interval = interval
+        self.workers = workers
+        self._task = None
+        self._wake = None
+        self._pending = set()
+
+    @property
+    def enabled(self):
+        return self.high > 0
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def request_refill(self, book=None):
+        if self._wake is not None:
+            if book:
+                self._pending.add(book)
+            self._wake.set()
+
+    async def _run(self):
+        slots = asyncio.Semaphore(self.workers)
+        while True:
+            try:
+                books = await self._books()
+                # Books that just ran short go first
+                ordered = [b for b in self._pending if b in books] + [b for b in books if b not in self._pending]
+                self._pending.clear()
+                await asyncio.gather(*(self._top_up(book, slots) for book in ordered))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Quiz bank refill failed: {e}")
+
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _top_up(self, book, slots):
+        if self.bank.available(book) >= self.low:
+            return
+        attempts = 0
+        while self.bank.available(book) < self.high and attempts < self._MAX_ATTEMPTS:
+            attempts += 1
+            async with slots:
+                questions = await self._generate(book, self.bank.topics(book))
+            added = self.bank.add(book, questions)
+            logger.info(f"🧠 Quiz bank: +{added} questions for {book} ({self.bank.available(book)} available)")
+            if not questions:
+                break
@@ -0,0 +1,151 @@
+import time
+import threading
+import traceback
+
+
+class IndexNotReady(Exception):
+    """Raised instead of blocking when the index is empty, unreachable or being ingested."""
+
+    def __init__(self, message, retry_after=30):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class IngestionJob:
+    """Runs ingestion on a background thread and records its state and progress."""
+
+    def __init__(self, run):
+        self._run = run
+        self._lock = threading.Lock()
+        self._thread = None
+        self.state = "idle"
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.result = None
+        self.progress = {}
+        self._listeners = []
+
+    @property
+    def running(self):
+        return self.state == "running"
+
+    def on_finish(self, callback):
+        self._listeners.append(callback)
+
+    def update(self, **progress):
+        with self._lock:
+            self.progress.update(progress)
+
+    def start(self):
+        """Start a run; returns False if one is already in progress."""
+        with self._lock:
+            if self.state == "running":
+                return False
+            self.state = "running"
+            self.started_at = time.time()
+            self.finished_at = None
+            self.error = None
+            self.result = None
+            self.progress = {}
+            self._thread = threading.Thread(target=self._target, name="ingestion-job", daemon=True)
+            self._thread.start()
+        return True
+
+    def _target(self):
+        try:
+            result = self._run(self.update)
+            with self._lock:
+                self.result = result
+                self.state = "succeeded"
+        except Exception as e:
+            traceback.print_exc()
+            with self._lock:
+                self.error = str(e)
+                self.state = "failed"
+        finally:
+            self.finished_at = time.time()
+            for callback in self._listeners:
+                callback(self)
+
+    def status(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "progress": dict(self.progress),
+                "result": self.result,
+                "error": self.error,
+            }
+
+
+class IndexReadiness:
+    """
+    Caches whether the index has data so requests don't call describe_index_stats().
+
+    A positive result is trusted for `ttl` seconds, a negative one for
+    `retry_ttl` seconds. While an ingestion job is running, an index that
+    already had data keeps serving and a cold one fails fast without probing.
+    """
+
+    def __init__(self, probe, job, ttl=300.0, retry_ttl=5.0):
+        self._probe = probe
+        self.job = job
+        self.ttl = ttl
+        self.retry_ttl = retry_ttl
+        self._lock = threading.Lock()
+        self.ready = False
+        self.vector_count = 0
+        self.error = None
+        # Never checked; 0.0 would look recent on a host booted less than `ttl` seconds ago
+        self.checked_at = float("-inf")
+        job.on_finish(lambda _: self.invalidate())
+
+    def expired(self):
+        ttl = self.ttl if self.ready else self.retry_ttl
+        return time.monotonic() - self.checked_at >= ttl
+
+    def check(self, force=False):
+        """Return the cached readiness, probing the index if the cached value has expired."""
+        now = time.monotonic()
+        ttl = self.ttl if self.ready else self.retry_ttl
+        if not force and now - self.checked_at < ttl:
+            return self.ready
+        with self._lock:
+            if not force and time.monotonic() - self.checked_at < ttl:
+                return self.ready
+            try:
+                self.vector_count = self._probe()
+                self.ready = self.vector_count > 0
+                self.error = None
+            except Exception as e:
+                self.ready = False
+                self.error = str(e)
+            self.checked_at = time.monotonic()
+            if self.ready:
+                print(f"✅ Connected to existing index with {self.vector_count} documents")
+            return self.ready
+
+    def invalidate(self):
+        self.checked_at = float("-inf")
+
+    def ensure_ready(self):
+        if self.job.running:
+            if self.ready:
+                return
+            raise IndexNotReady("Ingestion is in progress, try again shortly", retry_after=30)
+        if not self.check():
+            reason = self.error or "The index is empty"
+            raise IndexNotReady(f"No data available in vector index: {reason}", retry_after=int(self.retry_ttl) or 1)
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "vector_count": self.vector_count,
+            "error": self.error,
+            "checked_seconds_ago": (
+                round(time.monotonic() - self.checked_at, 1) if self.checked_at != float("-inf") else None
+            ),
+            "ingestion": self.job.status(),
+        }
@@ -0,0 +1,100 @@
+import json
+import time
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from config import METRICS_ENABLED, PROMPT_LOG_SAMPLE_RATE
+
+try:
+    from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+except ImportError:
+    Histogram = None
+
+_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+if METRICS_ENABLED and Histogram is not None:
+    STAGE_SECONDS = Histogram("wemakedev_stage_seconds", "Time spent in one pipeline stage", ["stage"], buckets=_BUCKETS)
+    REQUEST_SECONDS = Histogram(
+        "wemakedev_request_seconds", "HTTP request latency", ["endpoint", "method", "status"], buckets=_BUCKETS
+    )
+    # Coalescing ratio = coalesced / requests
+    FLIGHT_REQUESTS = Counter("wemakedev_coalesce_requests", "Calls into a single-flight group", ["group"])
+    FLIGHT_COALESCED = Counter(
+        "wemakedev_coalesce_coalesced", "Calls that joined an identical in-flight call", ["group"]
+    )
+else:
+    STAGE_SECONDS = REQUEST_SECONDS = FLIGHT_REQUESTS = FLIGHT_COALESCED = None
+
+# Labelled children are cached so a span costs two perf_counter calls and a dict lookup
+_stage_children = {}
+# Per-request {stage: seconds}; None outside a request (background tasks, ingestion threads)
+_timings = ContextVar("stage_timings", default=None)
+
+
+def record(stage, seconds):
+    """Add one stage duration to the histogram and to the current request's timings."""
+    if STAGE_SECONDS is not None:
+        child = _stage_children.get(stage)
+        if child is None:
+            child = _stage_children[stage] = STAGE_SECONDS.labels(stage)
+        child.observe(seconds)
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def span(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+@contextmanager
+def collect_timings():
+    """Collect the spans recorded in this context (and tasks started from it) into a dict."""
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def observe_request(endpoint, method, status, seconds):
+    if REQUEST_SECONDS is not None:
+        REQUEST_SECONDS.labels(endpoint, method, str(status)).observe(seconds)
+
+
+def observe_flight(group, coalesced):
+    if FLIGHT_REQUESTS is not None:
+        FLIGHT_REQUESTS.labels(group).inc()
+        if coalesced:
+            FLIGHT_COALESCED.labels(group).inc()
+
+
+def server_timing(timings, total=None):
+    """Format timings as a Server-Timing header value (durations in ms)."""
+    parts = [f"{stage};dur={1000 * seconds:.1f}" for stage, seconds in timings.items()]
+    if total is not None:
+        parts.append(f"total;dur={1000 * total:.1f}")
+    return ", ".join(parts)
+
+
+def format_timings(timings):
+    return ", ".join(f"{stage} {1000 * seconds:.0f}ms" for stage, seconds in timings.items())
+
+
+def metrics_payload():
+    """Return (body, content_type) for /metrics, or None when metrics are disabled or prometheus_client is missing."""
+    if STAGE_SECONDS is None:
+        return None
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def log_prompt(messages):
+    """Print the messages sent to the LLM for a PROMPT_LOG_SAMPLE_RATE fraction of calls."""
+    if PROMPT_LOG_SAMPLE_RATE > 0 and random.random() < PROMPT_LOG_SAMPLE_RATE:
+        print("📝 Sampled prompt: " + json.dumps(messages, ensure_ascii=False))
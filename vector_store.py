@@ -0,0 +1,454 @@
+import os
+import json
+import heapq
+import asyncio
+import time
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import numpy as np
+from config import (
+    PINECONE_API_KEY, PINECONE_INDEX_NAME, PINECONE_DIMENSION,
+    VECTOR_STORE, LOCAL_STORE_DIR, LOCAL_STORE_DTYPE, RETRIEVAL_WORKERS, VECTOR_NAMESPACES
+)
+
+
+@dataclass
+class Match:
+    id: str
+    score: float
+    metadata: dict = field(default_factory=dict)
+
+
+@dataclass
+class QueryResult:
+    matches: list
+
+
+@dataclass
+class IndexStats:
+    total_vector_count: int
+    dimension: int
+
+
+def book_namespace(book):
+    """Namespace a book's vectors are written to: the book itself, or the default one if VECTOR_NAMESPACES is off."""
+    return book if VECTOR_NAMESPACES else ""
+
+
+def book_scope(books):
+    """(namespaces, filter) that restrict a query to `books`; (None, None) searches every book."""
+    if not books:
+        return None, None
+    if VECTOR_NAMESPACES:
+        return list(books), None
+    return [""], {"book": {"$in": list(books)}}
+
+
+def merge_results(results, top_k):
+    """Merge per-namespace query results into one top_k list ordered by score."""
+    matches = heapq.nlargest(top_k, (match for result in results for match in result.matches), key=lambda m: m.score)
+    return QueryResult(matches=matches)
+
+
+class VectorStore:
+    """
+    The subset of the Pinecone index API the app uses. Query results expose
+    `.matches` (each with `.id`, `.score`, `.metadata`) and stats expose
+    `.total_vector_count`, so callers work the same against every backend.
+
+    Writes and deletes go to one namespace ("" is the default one). Queries
+    take a namespace too; None searches all of them.
+    """
+
+    def upsert(self, vectors, namespace=""):
+        raise NotImplementedError
+
+    def query(self, vector, top_k=10, filter=None, include_metadata=True, namespace=None):
+        raise NotImplementedError
+
+    async def aquery(self, vector, top_k=10, filter=None, include_metadata=True, namespace=None):
+        """Async query; network backends run the blocking call on their own bounded pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._query_executor(), lambda: self.query(vector, top_k, filter, include_metadata, namespace)
+        )
+
+    async def aquery_namespaces(self, vector, namespaces=None, top_k=10, filter=None, include_metadata=True):
+        """Query `namespaces` concurrently and merge the top_k matches by score; None searches every namespace."""
+        if not namespaces or len(namespaces) == 1:
+            namespace = namespaces[0] if namespaces else None
+            return await self.aquery(vector, top_k, filter, include_metadata, namespace)
+        results = await asyncio.gather(
+            *(self.aquery(vector, top_k, filter, include_metadata, namespace) for namespace in namespaces)
+        )
+        return merge_results(results, top_k)
+
+    def _query_executor(self):
+        if getattr(self, "_executor", None) is None:
+            self._executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+        return self._executor
+
+    def delete(self, ids, namespace=""):
+        raise NotImplementedError
+
+    def describe_index_stats(self):
+        raise NotImplementedError
+
+    def namespaces(self):
+        """Namespaces worth querying; one entry is enough for a scoped warm-up or sanity query."""
+        return [""]
+
+
+class PineconeStore(VectorStore):
+    # Seconds the namespace list used for unscoped queries is cached
+    _NAMESPACE_TTL = 60
+
+    def __init__(self, create=False):
+        from pinecone import Pinecone
+
+        self.pc = Pinecone(api_key=PINECONE_API_KEY)
+        if create:
+            self._create_if_missing()
+        # One pooled HTTP connection per retrieval worker, reused across requests
+        self.index = self.pc.Index(PINECONE_INDEX_NAME, pool_threads=RETRIEVAL_WORKERS)
+        self._namespaces = None
+        self._namespaces_at = 0.0
+        print(f"🔗 Connected to Pinecone index: {PINECONE_INDEX_NAME}")
+
+    def _create_if_missing(self):
+        from pinecone import ServerlessSpec
+
+        index_names = [idx['name'] for idx in self.pc.list_indexes().indexes]
+        if PINECONE_INDEX_NAME not in index_names:
+            print(f"📝 Creating new index '{PINECONE_INDEX_NAME}'")
+            self.pc.create_index(
+                name=PINECONE_INDEX_NAME,
+                dimension=PINECONE_DIMENSION,
+                metric="cosine",
+                spec=ServerlessSpec(cloud="aws", region="us-east-1")
+            )
+            time.sleep(10)
+
+    def namespaces(self):
+        """Namespaces that hold vectors, from index stats cached for _NAMESPACE_TTL seconds."""
+        if self._namespaces is None or time.monotonic() - self._namespaces_at > self._NAMESPACE_TTL:
+            self._namespaces = sorted(self.index.describe_index_stats().namespaces or {})
+            self._namespaces_at = time.monotonic()
+        return self._namespaces
+
+    def upsert(self, vectors, namespace=""):
+        if self._namespaces is not None and namespace not in self._namespaces:
+            self._namespaces = sorted(self._namespaces + [namespace])
+        return self.index.upsert(vectors=vectors, namespace=namespace)
+
+    def query(self, vector, top_k=10, filter=None, include_metadata=True, namespace=None):
+        if namespace is None:
+            namespaces = self.namespaces() or [""]
+            if len(namespaces) > 1:
+                # Blocking callers (warm-up, CLI checks) only; the API fans out concurrently through aquery
+                return merge_results(
+                    [self.query(vector, top_k, filter, include_metadata, name) for name in namespaces], top_k
+                )
+            namespace = namespaces[0]
+        params = {"vector": vector, "top_k": top_k, "include_metadata": include_metadata, "namespace": namespace}
+        if filter:
+            params["filter"] = filter
+        return self.index.query(**params)
+
+    async def aquery(self, vector, top_k=10, filter=None, include_metadata=True, namespace=None):
+        if namespace is None:
+            loop = asyncio.get_running_loop()
+            namespaces = await loop.run_in_executor(self._query_executor(), self.namespaces) or [""]
+            if len(namespaces) > 1:
+                return await self.aquery_namespaces(vector, namespaces, top_k, filter, include_metadata)
+            namespace = namespaces[0]
+        return await super().aquery(vector, top_k, filter, include_metadata, namespace)
+
+    def delete(self, ids, namespace=""):
+        return self.index.delete(ids=ids, namespace=namespace)
+
+    def describe_index_stats(self):
+        return self.index.describe_index_stats()
+
+
+class LocalStore(VectorStore):
+    """
+    In-process exact-search backend.
+
+    Unit-normalised embeddings live in a memory-mapped .npy matrix so cosine
+    similarity is a single matrix-vector product and opening the store does not
+    read the vectors into RAM. A float16 matrix halves the file; it is scored
+    through a float32 copy made on the first query and kept in step with
+    writes, because per-query float16 upcasts cost more than the scan. IDs and metadata live in SQLite next to it and are
+    only read for the top-k rows. Rows are partitioned by book: each row carries
+    the code of its namespace (or of its metadata `book` when written to the
+    default namespace, which is the flat layout), and the row numbers of each
+    partition are cached, so a namespace query or `book` filter scores only
+    that book's rows. The default namespace spans every partition. IDs are
+    unique across namespaces, so writing an ID to another namespace moves it. One process
+    writes (ingestion); readers pick up its commits on their next query.
+    """
+
+    _GROWTH = 2
+    _MIN_CAPACITY = 1024
+
+    def __init__(self, path=LOCAL_STORE_DIR, dimension=PINECONE_DIMENSION, dtype=LOCAL_STORE_DTYPE):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dimension = dimension
+        self.dtype = np.dtype(dtype)
+        self._matrix_path = os.path.join(path, "vectors.npy")
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(path, "store.sqlite"), check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS books (code INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL);
+            CREATE TABLE IF NOT EXISTS rows (
+                row INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                book_code INTEGER NOT NULL,
+                metadata TEXT NOT NULL,
+                namespaced INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(rows)")]
+        if "namespaced" not in columns:
+            # Rows from before namespaces were all written to the default namespace
+            self._conn.execute("ALTER TABLE rows ADD COLUMN namespaced INTEGER NOT NULL DEFAULT 0")
+        self._load()
+
+    def _data_version(self):
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _load(self):
+        with self._lock:
+            self._book_codes = dict(self._conn.execute("SELECT name, code FROM books"))
+            rows = self._conn.execute("SELECT row, book_code FROM rows").fetchall()
+            self._next_row = max((row for row, _ in rows), default=-1) + 1
+            if os.path.exists(self._matrix_path):
+                self._matrix = np.load(self._matrix_path, mmap_mode="r+")
+            else:
+                self._matrix = self._allocate(self._MIN_CAPACITY)
+            # -1 marks rows that were never written or have been deleted
+            self._codes = np.full(self._matrix.shape[0], -1, dtype=np.int32)
+            if rows:
+                row_ids, codes = zip(*rows)
+                self._codes[list(row_ids)] = codes
+            self._partitions = {}
+            # float32 copy of rows [0, _scoring_rows) of a float16 matrix, built by _float32_rows()
+            self._scoring = None
+            self._scoring_rows = 0
+            self._version = self._data_version()
+
+    def _allocate(self, capacity):
+        matrix = np.lib.format.open_memmap(
+            self._matrix_path + ".tmp", mode="w+", dtype=self.dtype, shape=(capacity, self.dimension)
+        )
+        if getattr(self, "_matrix", None) is not None:
+            matrix[:self._matrix.shape[0]] = self._matrix
+        matrix.flush()
+        del matrix
+        os.replace(self._matrix_path + ".tmp", self._matrix_path)
+        return np.load(self._matrix_path, mmap_mode="r+")
+
+    def _refresh_if_changed(self):
+        # data_version only changes when another connection (e.g. an ingestion run) commits
+        if self._data_version() != self._version:
+            self._load()
+
+    def _book_code(self, book):
+        code = self._book_codes.get(book)
+        if code is None:
+            code = len(self._book_codes)
+            self._conn.execute("INSERT INTO books (code, name) VALUES (?, ?)", (code, book))
+            self._book_codes[book] = code
+        return code
+
+    def _partition_rows(self, codes):
+        """Row numbers in the given partitions, cached per partition until the next write."""
+        parts = []
+        for code in codes:
+            rows = self._partitions.get(code)
+            if rows is None:
+                rows = self._partitions[code] = np.flatnonzero(self._codes[:self._next_row] == code)
+            parts.append(rows)
+        if len(parts) == 1:
+            return parts[0]
+        return np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+
+    def upsert(self, vectors, namespace=""):
+        if not vectors:
+            return
+        with self._lock:
+            self._refresh_if_changed()
+            ids = [v["id"] for v in vectors]
+            placeholders = ",".join("?" * len(ids))
+            existing = dict(self._conn.execute(f"SELECT id, row FROM rows WHERE id IN ({placeholders})", ids))
+
+            rows = []
+            for chunk_id in ids:
+                if chunk_id not in existing:
+                    existing[chunk_id] = self._next_row
+                    self._next_row += 1
+                rows.append(existing[chunk_id])
+
+            if self._next_row > self._matrix.shape[0]:
+                capacity = max(self._next_row, self._matrix.shape[0] * self._GROWTH)
+                self._matrix = self._allocate(capacity)
+                self._scoring = None
+                codes = np.full(capacity, -1, dtype=np.int32)
+                codes[:self._codes.shape[0]] = self._codes
+                self._codes = codes
+
+            values = np.asarray([v["values"] for v in vectors], dtype=np.float32)
+            norms = np.linalg.norm(values, axis=1, keepdims=True)
+            values /= np.maximum(norms, 1e-12)
+            self._matrix[rows] = values.astype(self.dtype)
+            if self._scoring is not None:
+                rewritten = [row for row in rows if row < self._scoring_rows]
+                self._scoring[rewritten] = self._matrix[rewritten]
+            self._matrix.flush()
+
+            with self._conn:
+                codes = [self._book_code(namespace or v.get("metadata", {}).get("book", "")) for v in vectors]
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO rows (row, id, book_code, metadata, namespaced) VALUES (?, ?, ?, ?, ?)",
+                    [(row, v["id"], code, json.dumps(v.get("metadata", {})), int(bool(namespace)))
+                     for row, v, code in zip(rows, vectors, codes)]
+                )
+            self._codes[rows] = codes
+            self._partitions = {}
+            self._version = self._data_version()
+
+    def delete(self, ids, namespace=""):
+        if not ids:
+            return
+        with self._lock:
+            self._refresh_if_changed()
+            placeholders = ",".join("?" * len(ids))
+            # Like Pinecone, a delete only touches rows written to `namespace`
+            where = f"id IN ({placeholders}) AND namespaced = ?"
+            params = list(ids) + [int(bool(namespace))]
+            if namespace:
+                if namespace not in self._book_codes:
+                    return
+                where += " AND book_code = ?"
+                params.append(self._book_codes[namespace])
+            rows = [row for (row,) in self._conn.execute(f"SELECT row FROM rows WHERE {where}", params)]
+            with self._conn:
+                self._conn.execute(f"DELETE FROM rows WHERE {where}", params)
+            self._codes[rows] = -1
+            self._partitions = {}
+            self._version = self._data_version()
+
+    def _filter_codes(self, filter):
+        """Translate a Pinecone-style filter on `book` into a set of book codes."""
+        unsupported = set(filter) - {"book"}
+        if unsupported:
+            raise ValueError(f"LocalStore only supports filtering on 'book', got {sorted(unsupported)}")
+        condition = filter["book"]
+        if isinstance(condition, dict):
+            if "$eq" in condition:
+                books = [condition["$eq"]]
+            elif "$in" in condition:
+                books = list(condition["$in"])
+            else:
+                raise ValueError(f"Unsupported book filter: {condition}")
+        else:
+            books = [condition]
+        return [self._book_codes[b] for b in books if b in self._book_codes]
+
+    def _float32_rows(self):
+        """float32 copy of a float16 matrix; only rows written since the last call are converted."""
+        if self._scoring is None:
+            self._scoring = np.empty(self._matrix.shape, dtype=np.float32)
+            self._scoring_rows = 0
+        if self._scoring_rows < self._next_row:
+            self._scoring[self._scoring_rows:self._next_row] = self._matrix[self._scoring_rows:self._next_row]
+            self._scoring_rows = self._next_row
+        return self._scoring
+
+    def _score(self, rows, query):
+        matrix = self._matrix if self.dtype == np.float32 else self._float32_rows()
+        return matrix[rows] @ query if rows is not None else matrix[:self._next_row] @ query
+
+    def query(self, vector, top_k=10, filter=None, include_metadata=True, namespace=None):
+        return self._query(vector, [namespace] if namespace else None, top_k, filter, include_metadata)
+
+    def _query(self, vector, namespaces, top_k, filter, include_metadata):
+        """One scan over the union of `namespaces` (None or "" = all rows), so a fan-out needs no merge."""
+        with self._lock:
+            self._refresh_if_changed()
+            query = np.asarray(vector, dtype=np.float32)
+            query /= max(float(np.linalg.norm(query)), 1e-12)
+
+            codes = None
+            if namespaces and "" not in namespaces:
+                codes = {self._book_codes[n] for n in namespaces if n in self._book_codes}
+            if filter:
+                filtered = set(self._filter_codes(filter))
+                codes = filtered if codes is None else codes & filtered
+            if codes is not None:
+                candidates = self._partition_rows(sorted(codes))
+                scores = self._score(candidates, query)
+            else:
+                candidates = None
+                scores = self._score(None, query)
+                scores[self._codes[:self._next_row] < 0] = -np.inf
+
+            if scores.size == 0 or top_k <= 0:
+                return QueryResult(matches=[])
+            k = min(top_k, scores.size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            top = top[np.isfinite(scores[top])]
+            rows = candidates[top] if candidates is not None else top
+
+            columns = "row, id, metadata" if include_metadata else "row, id, '{}'"
+            placeholders = ",".join("?" * len(rows))
+            found = {
+                row: (chunk_id, metadata)
+                for row, chunk_id, metadata in self._conn.execute(
+                    f"SELECT {columns} FROM rows WHERE row IN ({placeholders})", [int(r) for r in rows]
+                )
+            }
+        matches = []
+        for row, score in zip(rows, scores[top]):
+            chunk_id, metadata = found[int(row)]
+            matches.append(Match(id=chunk_id, score=float(score), metadata=json.loads(metadata)))
+        return QueryResult(matches=matches)
+
+    async def aquery(self, vector, top_k=10, filter=None, include_metadata=True, namespace=None):
+        # An in-memory scan is faster than a thread hand-off, so run it inline
+        return self.query(vector, top_k, filter, include_metadata, namespace)
+
+    async def aquery_namespaces(self, vector, namespaces=None, top_k=10, filter=None, include_metadata=True):
+        return self._query(vector, namespaces, top_k, filter, include_metadata)
+
+    def namespaces(self):
+        """Namespaces that hold rows: "" if any flat-layout rows remain, then each book namespace."""
+        with self._lock:
+            flat = self._conn.execute("SELECT 1 FROM rows WHERE namespaced = 0 LIMIT 1").fetchone()
+            names = [name for (name,) in self._conn.execute(
+                "SELECT DISTINCT b.name FROM rows r JOIN books b ON b.code = r.book_code WHERE r.namespaced = 1"
+            )]
+        return ([""] if flat else []) + sorted(names)
+
+    def describe_index_stats(self):
+        with self._lock:
+            self._refresh_if_changed()
+            return IndexStats(
+                total_vector_count=int(np.count_nonzero(self._codes[:self._next_row] >= 0)),
+                dimension=self.dimension
+            )
+
+
+def open_vector_store(create=False):
+    """Open the backend selected by VECTOR_STORE ('pinecone' or 'local')."""
+    if VECTOR_STORE == "local":
+        print(f"🗄️ Using local vector store at {LOCAL_STORE_DIR}")
+        return LocalStore()
+    if VECTOR_STORE == "pinecone":
+        return PineconeStore(create=create)
+    raise ValueError(f"Unknown VECTOR_STORE '{VECTOR_STORE}', expected 'pinecone' or 'local'")